@@ -0,0 +1,571 @@
+"""NER backends
+
+Every NLP tool is wrapped in a backend class with the same interface: a
+backend is created for one language and predicts the labels of batches of
+pretokenized sentences. The backends are registered by name ("spacy",
+"spacy_ner", "stanza", "stanza_int8", "gazetteer"), and the models are loaded
+on first use and cached.
+"""
+
+import hashlib
+import os
+import threading
+from profiling import stage
+
+# folder with the gazetteers of the GazetteerBackend, one file per language
+GAZETTEER_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                             "Data", "Gazetteers")
+
+
+def _package_version(name):
+    from importlib.metadata import version, PackageNotFoundError
+
+    try:
+        return version(name)
+    except PackageNotFoundError:
+        return "unknown"
+
+
+class NERBackend(object):
+    """Common interface of all NER backends
+
+    fine_grained: True if the predicted labels are not in the 4 label format
+    and have to be transformed with postprocess_labels()
+    """
+
+    fine_grained = False
+
+    def __init__(self, lang):
+        self.lang = lang
+
+    @classmethod
+    def languages(cls):
+        """Return the languages the backend supports"""
+        raise NotImplementedError
+
+    @classmethod
+    def model_name(cls, lang):
+        """Return the name of the model used for the given language"""
+        raise NotImplementedError
+
+    @classmethod
+    def model_version(cls, lang):
+        """Return the version of the model, without loading it"""
+        return "unknown"
+
+    def predict(self, sentences):
+        """Predict the labels of a batch of sentences
+
+        args: sentences (list of non-empty sentences, each a list of words)
+
+        return: list of the predicted labels of each sentence
+        """
+        raise NotImplementedError
+
+    def predict_text(self, text):
+        """Predict the labels of all words of a continuous text, the words
+        are separated by whitespaces
+        """
+
+        words = text.split()
+        return self.predict([words])[0] if words else []
+
+
+def _spacy_config(name):
+    """Read the config of an installed spaCy pipeline without loading its
+    weights
+
+    args: name (string, name of the pipeline package, e.g. "en_core_web_md",
+    or path of a pipeline folder)
+    """
+
+    import spacy
+
+    if spacy.util.is_package(name):
+        path = spacy.util.get_package_path(name)
+        # the data of a pipeline package is in the folder <name>-<version>
+        meta = spacy.util.get_model_meta(path)
+        path = path / f"{name}-{meta['version']}"
+    else:
+        path = spacy.util.ensure_path(name)
+
+    return spacy.util.load_config(path / "config.cfg")
+
+
+def _listener_upstreams(model_config):
+    """Names of the tok2vec resp. transformer components a component listens
+    to, found in the config of its model ("*" stands for any of them)
+    """
+
+    upstreams = set()
+
+    if isinstance(model_config, dict):
+        if "Listener" in str(model_config.get("@architectures", "")):
+            upstreams.add(model_config.get("upstream", "*"))
+        for value in model_config.values():
+            upstreams |= _listener_upstreams(value)
+
+    return upstreams
+
+
+def required_components(config, targets=("ner",)):
+    """Return the components of a spaCy pipeline which are needed to run the
+    target components: the targets themselves and the shared tok2vec resp.
+    transformer components they listen to
+
+    args: config (the config of the pipeline, see _spacy_config()), targets
+    (names of the components whose output is used)
+
+    return: list of the names of the needed components, in pipeline order
+    """
+
+    pipeline = config["nlp"]["pipeline"]
+    components = config["components"]
+    needed = {name for name in targets if name in pipeline}
+
+    for name in list(needed):
+        upstreams = _listener_upstreams(components[name].get("model", {}))
+        for other in pipeline:
+            factory = components[other].get("factory")
+            if other in upstreams or ("*" in upstreams and
+                                      factory in ("tok2vec", "transformer")):
+                needed.add(other)
+
+    return [name for name in pipeline if name in needed]
+
+
+class SpacyBackend(NERBackend):
+    """NER with the spaCy pipelines, the texts are only split at whitespaces
+
+    PROFILE: "full" loads all components of the pipeline (tagger, parser,
+    lemmatizer, ...), "ner" only the components the NER needs, see
+    required_components(); the other components are excluded and never
+    loaded
+
+    note: the NER doesn't predict entities across sentence starts, which are
+    set by the parser; without the parser (profile "ner"), the sentence starts
+    are taken from the input instead, see sentence_docs()
+    """
+
+    fine_grained = True
+    MODELS = {"en": "en_core_web_md", "es": "es_core_news_md"}
+    PROFILE = "full"
+
+    def __init__(self, lang):
+        import spacy
+        from utils import WhitespaceTokenizer
+
+        super().__init__(lang)
+        name = self.MODELS[lang]
+
+        if self.PROFILE == "ner":
+            config = _spacy_config(name)
+            needed = required_components(config)
+            exclude = [component for component in config["nlp"]["pipeline"]
+                       if component not in needed]
+            self.nlp = spacy.load(name, exclude=exclude)
+        else:
+            self.nlp = spacy.load(name)
+
+        self.nlp.tokenizer = WhitespaceTokenizer(self.nlp.vocab)
+
+    @classmethod
+    def languages(cls):
+        return list(cls.MODELS)
+
+    @classmethod
+    def model_name(cls, lang):
+        return cls.MODELS[lang]
+
+    @classmethod
+    def model_version(cls, lang):
+        return f"{_package_version('spacy')}/{_package_version(cls.MODELS[lang])}"
+
+    @staticmethod
+    def labels(doc):
+        """Return the labels of all tokens of a spaCy doc"""
+
+        # ent_iob_: return the Named Entities in the BIO format, and the
+        # non-entities as well ("O")
+        # ent_type_: type of the entity according to the SpaCy tag set
+        return [token.ent_iob_ + "-" + token.ent_type_ for token in doc]
+
+    def sentence_docs(self, sentences):
+        """Create one doc per sentence, split at whitespaces like the texts of
+        WhitespaceTokenizer: the first word starts the sentence of the doc, and
+        the other words don't start one
+        """
+
+        from spacy.tokens import Doc
+
+        for sentence in sentences:
+            words = " ".join(sentence).split()
+            yield Doc(self.nlp.vocab, words=words, spaces=[True] * len(words),
+                      sent_starts=[i == 0 for i in range(len(words))])
+
+    def predict(self, sentences):
+        if self.PROFILE == "ner":
+            inputs = self.sentence_docs(sentences)
+        else:
+            inputs = [" ".join(sentence) for sentence in sentences]
+        docs = self.nlp.pipe(inputs, batch_size=len(sentences))
+        return [self.labels(doc) for doc in docs]
+
+    def predict_text(self, text):
+        return self.labels(self.nlp(text))
+
+
+class SpacyNERBackend(SpacyBackend):
+    """The spaCy pipelines with the NER components only (profile "ner"),
+    with less work per token than SpacyBackend: every given sentence is one
+    sentence for the NER. The labels only differ from those of SpacyBackend
+    where its parser starts a sentence inside an entity, see
+    compare_backends() and test_backends.py
+
+    note: a continuous text (predict_text()) is not split into sentences
+    without the parser
+    """
+
+    PROFILE = "ner"
+
+
+class StanzaBackend(NERBackend):
+    """NER with the Stanza pipelines on pretokenized texts"""
+
+    MODELS = {"en": "conll03", "es": "conll02"}
+    # further arguments of stanza.Pipeline
+    PIPELINE_OPTIONS = {}
+
+    def __init__(self, lang):
+        import stanza
+
+        super().__init__(lang)
+        self.nlp = stanza.Pipeline(lang, processors="tokenize,ner",
+                                   package={"ner": [self.MODELS[lang]]},
+                                   tokenize_pretokenized=True,
+                                   **self.PIPELINE_OPTIONS)
+
+    @classmethod
+    def languages(cls):
+        return list(cls.MODELS)
+
+    @classmethod
+    def model_name(cls, lang):
+        return cls.MODELS[lang]
+
+    @classmethod
+    def model_version(cls, lang):
+        # the Stanza NER packages are versioned together with Stanza itself
+        return _package_version("stanza")
+
+    @staticmethod
+    def labels(doc):
+        """Return the labels of all tokens of a Stanza document"""
+
+        # token.ner: return the Named Entity tag of the current token
+        return [token.ner for sent in doc.sentences for token in sent.tokens]
+
+    def predict(self, sentences):
+        # with pretokenized input Stanza treats each list of words as a
+        # sentence of its own
+        doc = self.nlp(sentences)
+        return [[token.ner for token in sent.tokens] for sent in doc.sentences]
+
+    def predict_text(self, text):
+        return self.labels(self.nlp(text))
+
+
+def _ner_trainers(pipeline):
+    """Return the trainers of the NER processor of a Stanza pipeline, they
+    hold the PyTorch models of the NER taggers
+    """
+
+    processor = pipeline.processors["ner"]
+
+    # newer versions of Stanza can combine several NER models
+    trainers = getattr(processor, "trainers", None)
+    return list(trainers) if trainers else [processor._trainer]
+
+
+class StanzaInt8Backend(StanzaBackend):
+    """Stanza with NER models quantized to int8 for faster inference on
+    CPUs: the weights of the linear and LSTM layers are stored as 8 bit
+    integers (dynamic quantization of PyTorch), the activations are
+    quantized on the fly
+
+    The labels can differ slightly from those of StanzaBackend, the accuracy
+    can be compared with check_backends.py --max-accuracy-drop.
+
+    THREADS: number of PyTorch threads, e.g. the number of physical cores of
+    the host; the environment variable NER_THREADS is used if it is None, and
+    the default of PyTorch if neither is set
+    """
+
+    # the quantized models only run on the CPU
+    PIPELINE_OPTIONS = {"use_gpu": False}
+    THREADS = None
+
+    def __init__(self, lang):
+        import torch
+
+        threads = self.THREADS or int(os.environ.get("NER_THREADS", 0))
+        if threads:
+            torch.set_num_threads(threads)
+
+        super().__init__(lang)
+
+        for trainer in _ner_trainers(self.nlp):
+            trainer.model = torch.quantization.quantize_dynamic(
+                trainer.model, {torch.nn.Linear, torch.nn.LSTM}, dtype=torch.qint8)
+
+    @classmethod
+    def model_version(cls, lang):
+        # the quantized weights depend on the version of PyTorch as well
+        return f"{_package_version('stanza')}/int8/{_package_version('torch')}"
+
+
+class TokenTrie(object):
+    """Trie over sequences of words, used to find the longest entry of a
+    gazetteer which begins at a given position of a sentence
+    """
+
+    # key of the entity type in the node where an entry ends, can't be a word
+    END = None
+
+    def __init__(self):
+        self.root = {}
+
+    def add(self, words, entity_type):
+        node = self.root
+        for word in words:
+            node = node.setdefault(word, {})
+        node[self.END] = entity_type
+
+    def longest_match(self, words, start):
+        """Return (end, entity type) of the longest entry beginning at the
+        index start of words, or None if no entry begins there
+        """
+
+        node = self.root
+        match = None
+
+        for i in range(start, len(words)):
+            node = node.get(words[i])
+            if node is None:
+                break
+            if self.END in node:
+                match = (i + 1, node[self.END])
+
+        return match
+
+
+class GazetteerBackend(NERBackend):
+    """Very fast baseline NER with a dictionary of known Named Entities: the
+    longest gazetteer entry beginning at each position is labeled, from left
+    to right, in the BIO format with the 4 labels PER, LOC, ORG and MISC
+
+    The gazetteer of a language is the file GAZETTEER_DIR/<lang>.tsv with one
+    entry per line: the words of the entity separated by spaces, a tab and
+    the entity type. build_gazetteer() creates such a file from an annotated
+    CoNLL corpus (see build_gazetteer.py); no gazetteers are shipped, so the
+    backend has no languages until one is created.
+    """
+
+    def __init__(self, lang):
+        super().__init__(lang)
+        self.trie = TokenTrie()
+
+        with open(self.model_name(lang), "r", encoding="utf-8") as infile:
+            for line in infile:
+                entry, _, entity_type = line.rstrip("\r\n").rpartition("\t")
+                if entry.split() and entity_type:
+                    self.trie.add(entry.split(), entity_type)
+
+    @classmethod
+    def languages(cls):
+        if not os.path.isdir(GAZETTEER_DIR):
+            return []
+        return [name[:-4] for name in os.listdir(GAZETTEER_DIR)
+                if name.endswith(".tsv")]
+
+    @classmethod
+    def model_name(cls, lang):
+        return os.path.join(GAZETTEER_DIR, f"{lang}.tsv")
+
+    @classmethod
+    def model_version(cls, lang):
+        # the content of the gazetteer is its version
+        with open(cls.model_name(lang), "rb") as infile:
+            return hashlib.sha256(infile.read()).hexdigest()[:16]
+
+    def predict(self, sentences):
+        preds = []
+
+        for words in sentences:
+            labels = []
+            i = 0
+            while i < len(words):
+                match = self.trie.longest_match(words, i)
+                if match is None:
+                    labels.append("O")
+                    i += 1
+                else:
+                    end, entity_type = match
+                    labels.append("B-" + entity_type)
+                    labels.extend(["I-" + entity_type] * (end - i - 1))
+                    i = end
+            preds.append(labels)
+
+        return preds
+
+
+def build_gazetteer(conll_paths, lang, min_count=1):
+    """Create the gazetteer of a language from the gold labels of annotated
+    CoNLL files, e.g. a training corpus
+
+    args: conll_paths (list of full paths of the files), lang (string,
+    language of the gazetteer), min_count (int, minimal number of occurrences
+    of an entry)
+
+    return: path (string, full path of the gazetteer file)
+    """
+
+    from collections import Counter
+    from utils import read_conll
+    from evaluation import extract_entities
+
+    counts = Counter()
+    for path in conll_paths:
+        for words, labels in read_conll(path):
+            for start, end, entity_type in extract_entities(labels):
+                counts[(" ".join(words[start:end]), entity_type)] += 1
+
+    # an entry which occurs with several types gets its most frequent type
+    entries = {}
+    for (entry, entity_type), count in counts.most_common():
+        if count >= min_count and entry not in entries:
+            entries[entry] = entity_type
+
+    os.makedirs(GAZETTEER_DIR, exist_ok=True)
+    path = GazetteerBackend.model_name(lang)
+    with open(path, "w", encoding="utf-8") as outfile:
+        for entry, entity_type in sorted(entries.items()):
+            outfile.write(f"{entry}\t{entity_type}\n")
+
+    return path
+
+
+def compare_backends(reference, candidate, lang, sentences, batch_size=64):
+    """Check that two backends predict the same labels, e.g. the full spaCy
+    pipelines ("spacy") and the pipelines with the NER components only
+    ("spacy_ner")
+
+    args: reference, candidate (strings, names of the backends), lang
+    (string, "en" or "es"), sentences (list of sentences, each a list of
+    words), batch_size (int, number of sentences per batch)
+
+    return: list of the indexes of the sentences with different labels,
+    empty if the labels are the same
+    """
+
+    backend_a = get_model(reference, lang)
+    backend_b = get_model(candidate, lang)
+    # empty sentences do not have any labels and are not given to the models
+    indexes = [i for i, sentence in enumerate(sentences) if sentence]
+    differences = []
+
+    for start in range(0, len(indexes), batch_size):
+        batch_indexes = indexes[start:start + batch_size]
+        batch = [sentences[i] for i in batch_indexes]
+        preds_a = backend_a.predict(batch)
+        preds_b = backend_b.predict(batch)
+        differences.extend(i for i, a, b in zip(batch_indexes, preds_a, preds_b)
+                           if a != b)
+
+    return differences
+
+
+# registered backends: name -> backend class
+BACKENDS = {
+    "spacy": SpacyBackend,
+    "spacy_ner": SpacyNERBackend,
+    "stanza": StanzaBackend,
+    "stanza_int8": StanzaInt8Backend,
+    "gazetteer": GazetteerBackend,
+}
+
+# cache of the backends which were already loaded, the models are only loaded
+# when they are used for the first time
+_loaded_models = {}
+_models_lock = threading.Lock()
+
+
+def register_backend(name, backend_class):
+    """Register a new backend (subclass of NERBackend) under the given name,
+    it can then be used everywhere in place of "spacy" or "stanza"
+    """
+
+    BACKENDS[name] = backend_class
+
+
+def get_backend_class(model):
+    """Return the backend class registered under the given name
+
+    note: raises a ValueError for unknown backends
+    """
+
+    if model not in BACKENDS:
+        raise ValueError(f"Unknown NER backend: {model!r}")
+    return BACKENDS[model]
+
+
+def get_model(model, lang):
+    """Return the backend of the given NLP tool for the given language, the
+    model is loaded on first use and cached for all later calls
+
+    args: model (string, name of the backend, e.g. "spacy" or "stanza"), lang
+    (string, "en" or "es")
+
+    return: the backend (NERBackend)
+
+    note: raises a ValueError for unknown combinations of tool and language
+    """
+
+    if lang not in get_backend_class(model).languages():
+        raise ValueError(f"Unknown language model: {model!r} for language {lang!r}")
+
+    with _models_lock:
+        if (model, lang) not in _loaded_models:
+            with stage("model_load", model=model, lang=lang):
+                _loaded_models[(model, lang)] = BACKENDS[model](lang)
+        return _loaded_models[(model, lang)]
+
+
+def preload_models(pairs=None):
+    """Load the given language models in advance, e.g. at the start of a
+    worker process, so that the first call of ner() is not slowed down
+
+    args: pairs (list of (model, lang) tuples, the spaCy and Stanza models
+    for English and Spanish if None)
+    """
+
+    if pairs is None:
+        pairs = [(model, lang) for model in ("spacy", "stanza")
+                 for lang in BACKENDS[model].languages()]
+
+    for model, lang in pairs:
+        get_model(model, lang)
+
+
+def unload_models(pairs=None):
+    """Remove the given language models from the cache to free the memory
+
+    args: pairs (list of (model, lang) tuples, all loaded models if None)
+    """
+
+    with _models_lock:
+        if pairs is None:
+            pairs = list(_loaded_models)
+
+        for pair in pairs:
+            _loaded_models.pop(tuple(pair), None)
@@ -0,0 +1,347 @@
+"""Benchmark of the NER of SpaCy and Stanza
+
+Runs the chosen configurations (corpus, tool, batch size, number of worker
+processes) with warm-up runs and several repetitions, and writes the results
+as JSON. Example:
+
+    python benchmark.py --corpus europarl_en europarl_es --tool spacy stanza
+                        --batch-size 32 64 --workers 1 4 --repeat 5
+
+With --max-tokens the sentences are grouped by length into batches under a
+token budget instead of batches of --batch-size sentences (0 turns this off),
+the batch size is then not used and left out of the results. Without
+--max-tokens the token budget is DEFAULT_MAX_TOKENS, unless --batch-size is
+given: then the batches have a fixed number of sentences.
+
+With several workers, one pool of worker processes is started per
+configuration and used for the warm-up and all measured runs; the model
+loading time is then the time until every worker has loaded the model. The
+latencies are always those of the single batches.
+
+Every configuration runs in a new process, so that each of them loads its
+model itself and its peak memory doesn't include that of the configurations
+before it.
+"""
+
+import argparse
+from datetime import datetime, timezone
+from concurrent.futures import ProcessPoolExecutor
+from itertools import product
+import json
+import os
+import platform
+from time import perf_counter
+from utils import (get_model, unload_models, load_europarl_sentences,
+                   load_subtitles, split_sentences, ner_batch, iter_batches,
+                   plan_batches, batch_fill, DEFAULT_BATCH_SIZE, DEFAULT_MAX_TOKENS)
+from backends import BACKENDS
+from parallel import create_pool, split_shards, SHARDS_PER_WORKER
+
+# Get the full path of the directory where the current file is located
+dir_path = os.path.dirname(os.path.abspath(__file__))
+
+# get the parent directory path
+parent_dir_path = os.path.dirname(dir_path)
+parent_dir_path = parent_dir_path.replace('\\','/')
+
+# corpora available for the benchmark: name -> (path, type, language)
+CORPORA = {
+    "europarl_en": ("Data/Europarl Corpus/en-europarl.test.conll02", "conll", "en"),
+    "europarl_es": ("Data/Europarl Corpus/es-europarl.test.conll02", "conll", "es"),
+    "back_to_the_future_en": ("Data/Movie subtitles/Back To The Future (EN).txt", "subtitles", "en"),
+    "back_to_the_future_es": ("Data/Movie subtitles/Back To The Future (ES).txt", "subtitles", "es"),
+    "el_hoyo_en": ("Data/Movie subtitles/El Hoyo (EN).txt", "subtitles", "en"),
+    "el_hoyo_es": ("Data/Movie subtitles/El Hoyo (ES).txt", "subtitles", "es"),
+}
+
+DEFAULT_OUTPUT = f"{parent_dir_path}/Evaluation Results/benchmark.json"
+
+
+def load_corpus(name):
+    """Load one of the corpora of the benchmark as a list of sentences
+
+    args: name (string, key of CORPORA)
+
+    return: sentences (list of sentences, each a list of words), lang
+    (string, language of the corpus)
+    """
+
+    path, corpus_type, lang = CORPORA[name]
+    path = f"{parent_dir_path}/{path}"
+
+    if corpus_type == "conll":
+        sentences, _ = load_europarl_sentences(path)
+    else:
+        words, _ = load_subtitles(path)
+        sentences = split_sentences(words)
+
+    return sentences, lang
+
+
+def peak_rss_mb():
+    """Return the peak resident memory of this process in MB, or None if it
+    can't be measured (e.g. on Windows)
+    """
+
+    try:
+        import resource
+    except ImportError:
+        return None
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    # ru_maxrss is given in bytes on macOS and in kilobytes on Linux
+    if platform.system() == "Darwin":
+        return peak / (1024 * 1024)
+    return peak / 1024
+
+
+def percentile(values, q):
+    """Return the q-th percentile (0-100) of the values, with linear
+    interpolation between the closest ranks
+    """
+
+    values = sorted(values)
+    if not values:
+        return None
+
+    rank = (len(values) - 1) * q / 100
+    low = int(rank)
+    high = min(low + 1, len(values) - 1)
+
+    return values[low] + (values[high] - values[low]) * (rank - low)
+
+
+def make_batches(sentences, batch_size, max_tokens):
+    """Split the sentences into the batches ner_sentences() would use
+
+    args: sentences (list of sentences), batch_size (int, number of sentences
+    per batch), max_tokens (int, token budget of the length-bucketed batches,
+    None for batches of batch_size sentences)
+
+    return: list of batches, each a list of sentences
+    """
+
+    if max_tokens is None:
+        return list(iter_batches(sentences, batch_size))
+
+    lengths = [len(sentence) for sentence in sentences]
+    return [[sentences[i] for i in batch]
+            for batch in plan_batches(lengths, max_tokens)]
+
+
+def _run_batches(batches, tool, lang):
+    """Run the NER on the given batches in this process, e.g. a worker
+    process of the pool, and measure each batch
+
+    return: latencies (list of the durations of the single batches in
+    seconds), pid (int, id of the process), peak (float, peak memory of the
+    process in MB, see peak_rss_mb())
+    """
+
+    backend = get_model(tool, lang)
+    latencies = []
+
+    for batch in batches:
+        start = perf_counter()
+        ner_batch(backend, batch)
+        latencies.append(perf_counter() - start)
+
+    return latencies, os.getpid(), peak_rss_mb()
+
+
+def _run_once(batches, tool, lang, executor=None, n_shards=1):
+    """Run the NER once on all batches, in this process or with a pool of
+    worker processes which is reused for all runs
+
+    args: batches (list of batches, see make_batches()), tool, lang,
+    executor (pool created with create_pool(), None to run in this process),
+    n_shards (int, number of parts the batches are split into for the pool)
+
+    return: duration (float, seconds), latencies (list of the durations of
+    the single batches in seconds, measured in the process running them),
+    peaks (dictionary, id of a worker process -> its peak memory in MB, empty
+    without pool)
+    """
+
+    start = perf_counter()
+
+    if executor is None:
+        latencies, _, _ = _run_batches(batches, tool, lang)
+        peaks = {}
+    else:
+        shards = split_shards(batches, n_shards)
+        n = len(shards)
+        latencies = []
+        peaks = {}
+        for shard_latencies, pid, peak in executor.map(_run_batches, shards,
+                                                       [tool] * n, [lang] * n):
+            latencies.extend(shard_latencies)
+            peaks[pid] = peak
+
+    return perf_counter() - start, latencies, peaks
+
+
+def benchmark(corpus, tool, batch_size=DEFAULT_BATCH_SIZE,
+              max_tokens=DEFAULT_MAX_TOKENS, workers=1, repeat=5, warmup=1):
+    """Benchmark one configuration
+
+    args: corpus (string, key of CORPORA), tool (string, name of the
+    backend, e.g. "spacy" or "stanza"), batch_size (int, number of sentences
+    per batch, not used with max_tokens), max_tokens
+    (int, token budget of the length-bucketed batches, None for batches of
+    batch_size sentences), workers (int,
+    number of worker processes), repeat (int, number of measured runs),
+    warmup (int, number of runs before the measurement)
+
+    return: result (dictionary with the configuration and the measurements)
+
+    note: the peak memory is that of the calling process plus the sum of the
+    peaks of the worker processes, so a configuration should run in a new
+    process (see main()) not to include the memory of earlier ones
+    """
+
+    start = perf_counter()
+    sentences, lang = load_corpus(corpus)
+    load_data = perf_counter() - start
+    n_tokens = sum(len(sentence) for sentence in sentences)
+
+    batches = make_batches(sentences, batch_size, max_tokens)
+    n_shards = min(workers * SHARDS_PER_WORKER, len(batches))
+
+    # the model is loaded before the runs (with several workers: the pool is
+    # started and every worker loads the model), so its loading time is
+    # measured separately and not included in the throughput
+    start = perf_counter()
+    if workers > 1:
+        executor = create_pool(tool, lang, workers)
+    else:
+        executor = None
+        get_model(tool, lang)
+    load_model = perf_counter() - start
+
+    # the same pool is used for the warm-up and all measured runs
+    worker_peaks = {}
+    try:
+        for _ in range(warmup):
+            _, _, peaks = _run_once(batches, tool, lang, executor, n_shards)
+            worker_peaks.update(peaks)
+
+        durations = []
+        latencies = []
+        for _ in range(repeat):
+            duration, run_latencies, peaks = _run_once(batches, tool, lang,
+                                                       executor, n_shards)
+            durations.append(duration)
+            latencies.extend(run_latencies)
+            worker_peaks.update(peaks)
+    finally:
+        if executor is not None:
+            executor.shutdown()
+        # the next configuration has to load the model again
+        unload_models([(tool, lang)])
+
+    peak_rss = peak_rss_mb()
+    if peak_rss is not None:
+        peak_rss += sum(worker_peaks.values())
+
+    mean = sum(durations) / len(durations)
+    variance = sum((d - mean) ** 2 for d in durations) / len(durations)
+
+    return {
+        "corpus": corpus,
+        "tool": tool,
+        "lang": lang,
+        "batch_size": batch_size if max_tokens is None else None,
+        "max_tokens": max_tokens,
+        "batch_fill": batch_fill(batches),
+        "workers": workers,
+        "repeat": repeat,
+        "warmup": warmup,
+        "tokens": n_tokens,
+        "sentences": len(sentences),
+        "data_load_sec": load_data,
+        "model_load_sec": load_model,
+        "durations_sec": durations,
+        "mean_sec": mean,
+        "std_sec": variance ** 0.5,
+        "tokens_per_sec": n_tokens / mean if mean else None,
+        "latency_ms": {f"p{q}": percentile(latencies, q) * 1000
+                       for q in (50, 90, 99)},
+        "peak_rss_mb": peak_rss,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark of the NER of SpaCy and Stanza")
+    parser.add_argument("--corpus", nargs="+", default=["europarl_en"],
+                        choices=sorted(CORPORA))
+    parser.add_argument("--tool", nargs="+", default=["spacy", "stanza"],
+                        choices=sorted(BACKENDS))
+    parser.add_argument("--batch-size", nargs="+", type=int,
+                        help=f"number of sentences per batch (default: {DEFAULT_BATCH_SIZE}), "
+                             "only used without token budget")
+    parser.add_argument("--max-tokens", nargs="+", type=int,
+                        help="token budget of the length-bucketed batches, "
+                             "0 for batches of --batch-size sentences (default: "
+                             f"0 with --batch-size, {DEFAULT_MAX_TOKENS} otherwise)")
+    parser.add_argument("--workers", nargs="+", type=int, default=[1])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--warmup", type=int, default=1)
+    parser.add_argument("--output", default=DEFAULT_OUTPUT,
+                        help="path of the JSON file with the results")
+    args = parser.parse_args(argv)
+
+    if args.repeat < 1:
+        parser.error("--repeat must be at least 1")
+    if args.warmup < 0:
+        parser.error("--warmup must not be negative")
+
+    # batch sizes given without token budget are compared as they are
+    if args.max_tokens is None:
+        args.max_tokens = [0] if args.batch_size else [DEFAULT_MAX_TOKENS]
+    if args.batch_size is None:
+        args.batch_size = [DEFAULT_BATCH_SIZE]
+
+    # the batch size is not used under a token budget, so these
+    # configurations are only run once
+    batching = []
+    for max_tokens, batch_size in product(args.max_tokens, args.batch_size):
+        if max_tokens:
+            batch_size = None
+        if (batch_size, max_tokens) not in batching:
+            batching.append((batch_size, max_tokens))
+
+    results = []
+    for corpus, tool, (batch_size, max_tokens), workers in product(
+            args.corpus, args.tool, batching, args.workers):
+        # a new process per configuration, see benchmark()
+        with ProcessPoolExecutor(max_workers=1) as runner:
+            result = runner.submit(benchmark, corpus, tool, batch_size,
+                                   max_tokens or None, workers, args.repeat,
+                                   args.warmup).result()
+        results.append(result)
+        print(f"{corpus:<22}|{tool:<7}|batch {batch_size or '-':<5}|"
+              f"max tokens {max_tokens or '-':<5}|"
+              f"workers {workers:<3}|"
+              f"{round(result['tokens_per_sec'], 1):>10} tokens/sec|"
+              f"fill {round(result['batch_fill'], 3)}|"
+              f"p50 {round(result['latency_ms']['p50'], 1)} ms")
+
+    report = {
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "results": results,
+    }
+
+    with open(args.output, "w", encoding="utf-8") as outfile:
+        json.dump(report, outfile, indent=2)
+
+    return report
+
+
+# the main guard is needed by the worker processes of the NER
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from utils import (read_conll, get_model, iter_batches, postprocess_labels,
+                   ner_batch, DEFAULT_BATCH_SIZE)
+from evaluation import compare_labels, extract_entities
+
+
+def iter_aligned(path_en, path_es, **kwargs):
+    """Read two parallel CoNLL files (e.g. the English and Spanish europarl
+    files) in lockstep
+
+    args: path_en, path_es (strings, full paths of the files), kwargs
+    (further arguments of read_conll())
+
+    return: generator of ((words_en, labels_en), (words_es, labels_es))
+    tuples, one per sentence pair
+
+    note: raises a ValueError if the files don't have the same number of
+    sentences
+    """
+
+    yield from zip(read_conll(path_en, **kwargs), read_conll(path_es, **kwargs),
+                   strict=True)
+
+
+def entity_agreement(labels_en, labels_es):
+    """Measure how well the Named Entities of two parallel sentences agree:
+    the entity types are compared as multisets, since the word order differs
+    between the languages
+
+    args: labels_en, labels_es (lists of labels in the 4 label format)
+
+    return: agreement (float between 0 and 1, the number of entities of the
+    same type found in both sentences, divided by the number of entities of
+    the sentence with more entities; 1.0 if neither has an entity), types_en,
+    types_es (Counters of the entity types)
+    """
+
+    types_en = Counter(entity[2] for entity in extract_entities(labels_en))
+    types_es = Counter(entity[2] for entity in extract_entities(labels_es))
+
+    total = max(sum(types_en.values()), sum(types_es.values()))
+    if total == 0:
+        return 1.0, types_en, types_es
+
+    common = sum((types_en & types_es).values())
+
+    return common / total, types_en, types_es
+
+
+def run_bilingual(path_en, path_es, model, batch_size=DEFAULT_BATCH_SIZE):
+    """Perform the NER on two parallel CoNLL files in one pass: the English
+    and the Spanish side of each batch of sentence pairs are processed at the
+    same time, and the per-language accuracy and the cross-lingual entity
+    agreement of each sentence pair are computed on the fly
+
+    args: path_en, path_es (strings, full paths of the files), model (string,
+    language model to be used i.e. spaCy or Stanza), batch_size (int, number
+    of sentence pairs processed together)
+
+    return: results (dictionary with accuracy_en, accuracy_es, the mean
+    agreement of the predictions and of the gold labels, and pairs: list of
+    (index, agreement, types_en, types_es) of each sentence pair)
+
+    note: the models are loaded on first use, to measure the NER only they
+    have to be loaded before with preload_models()
+    """
+
+    backend_en = get_model(model, "en")
+    backend_es = get_model(model, "es")
+
+    matches = {"en": 0, "es": 0}
+    n_words = {"en": 0, "es": 0}
+    pairs = []
+    gold_agreement = 0.0
+
+    # the two models run in two threads, most of their work is done outside
+    # of the Python interpreter lock
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        for batch in iter_batches(iter_aligned(path_en, path_es), batch_size):
+            future_en = executor.submit(ner_batch, backend_en,
+                                        [en[0] for en, _ in batch])
+            future_es = executor.submit(ner_batch, backend_es,
+                                        [es[0] for _, es in batch])
+            preds_en = future_en.result()
+            preds_es = future_es.result()
+
+            for (en, es), pred_en, pred_es in zip(batch, preds_en, preds_es):
+                if backend_en.fine_grained:
+                    pred_en = postprocess_labels(pred_en)
+                    pred_es = postprocess_labels(pred_es)
+
+                for lang, gold, pred in (("en", en[1], pred_en), ("es", es[1], pred_es)):
+                    if gold:
+                        _, diff_indexes = compare_labels(gold, pred)
+                        matches[lang] += len(gold) - len(diff_indexes)
+                        n_words[lang] += len(gold)
+
+                agreement, types_en, types_es = entity_agreement(pred_en, pred_es)
+                pairs.append((len(pairs), agreement, types_en, types_es))
+                gold_agreement += entity_agreement(en[1], es[1])[0]
+
+    return {
+        "accuracy_en": matches["en"] / n_words["en"] if n_words["en"] else 0.0,
+        "accuracy_es": matches["es"] / n_words["es"] if n_words["es"] else 0.0,
+        "agreement": sum(pair[1] for pair in pairs) / len(pairs) if pairs else 0.0,
+        "gold_agreement": gold_agreement / len(pairs) if pairs else 0.0,
+        "pairs": pairs,
+    }
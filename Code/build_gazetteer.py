@@ -0,0 +1,88 @@
+"""Creation of the gazetteers of the gazetteer backend (see backends.py)
+
+The gazetteer of a language is created from the gold labels of annotated
+CoNLL files, e.g. the training files of CoNLL 2003 (English) resp. CoNLL 2002
+(Spanish), and written to Data/Gazetteers/<lang>.tsv:
+
+    python build_gazetteer.py --lang en --conll eng.train
+    python build_gazetteer.py --lang es --conll esp.train --min-count 2
+
+The Europarl files in Data/Europarl Corpus can't be used: they are the
+corpora the backends are evaluated on, and a gazetteer built from them would
+know all of their entities in advance.
+"""
+
+import argparse
+import hashlib
+import os
+import sys
+from backends import build_gazetteer
+
+# Get the full path of the directory where the current file is located
+dir_path = os.path.dirname(os.path.abspath(__file__))
+
+# get the parent directory path
+parent_dir_path = os.path.dirname(dir_path)
+parent_dir_path = parent_dir_path.replace('\\','/')
+
+# folder with the evaluation corpora, which must not be used for a gazetteer
+EVALUATION_DIR = f"{parent_dir_path}/Data/Europarl Corpus"
+
+
+def _file_hash(path):
+    with open(path, "rb") as infile:
+        return hashlib.sha256(infile.read()).hexdigest()
+
+
+def check_sources(paths, evaluation_dir=EVALUATION_DIR):
+    """Check that none of the given files is one of the evaluation corpora,
+    also not as a copy under another name
+
+    args: paths (list of full paths of the CoNLL files), evaluation_dir
+    (string, folder with the evaluation corpora)
+
+    note: raises a ValueError for evaluation corpora and missing files
+    """
+
+    evaluation_hashes = {}
+    if os.path.isdir(evaluation_dir):
+        for name in os.listdir(evaluation_dir):
+            path = os.path.join(evaluation_dir, name)
+            if os.path.isfile(path):
+                evaluation_hashes[_file_hash(path)] = name
+
+    for path in paths:
+        if not os.path.isfile(path):
+            raise ValueError(f"No such file: {path!r}")
+        name = evaluation_hashes.get(_file_hash(path))
+        if name is not None:
+            raise ValueError(f"{path!r} is the evaluation corpus {name!r}, please use "
+                             "annotated files which are not evaluated, e.g. training data")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Create the gazetteer of the gazetteer backend")
+    parser.add_argument("--lang", required=True, help="language of the gazetteer, e.g. en")
+    parser.add_argument("--conll", nargs="+", required=True,
+                        help="paths of the annotated CoNLL files")
+    parser.add_argument("--min-count", type=int, default=1,
+                        help="minimal number of occurrences of an entity")
+    args = parser.parse_args(argv)
+
+    try:
+        check_sources(args.conll)
+    except ValueError as error:
+        print(error)
+        return 1
+
+    path = build_gazetteer(args.conll, args.lang, args.min_count)
+
+    with open(path, "r", encoding="utf-8") as infile:
+        n_entries = sum(1 for _ in infile)
+    print(f"{n_entries} entries written to {path}")
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
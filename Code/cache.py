@@ -0,0 +1,206 @@
+from array import array
+import hashlib
+import json
+import os
+import struct
+import zlib
+from utils import get_backend_class
+
+# default location of the cache: the folder ".ner_cache" in the project folder
+DEFAULT_CACHE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                 ".ner_cache")
+
+# default maximum size of the cache in bytes (256 MB)
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+
+# first bytes of every cache file, followed by the length of the header
+MAGIC = b"NERC1"
+
+
+def model_version(model, lang):
+    """Return the version of the given language model without loading it
+
+    args: model (string, name of the backend), lang (string, "en" or "es")
+
+    return: version (string, see NERBackend.model_version())
+    """
+
+    return get_backend_class(model).model_version(lang)
+
+
+def cache_key(sentences, model, lang):
+    """Compute the key of the predictions for the given sentences, i.e. a
+    hash of the words, the sentence boundaries, the NLP tool, the language,
+    and the name and version of the language model
+
+    args: sentences (iterable of sentences, each a list of words), model
+    (string, "spacy" or "stanza"), lang (string, "en" or "es")
+
+    return: key (string, hexadecimal SHA-256 hash)
+    """
+
+    key = hashlib.sha256()
+    key.update(f"{model}\x1f{lang}\x1f{get_backend_class(model).model_name(lang)}\x1f"
+               f"{model_version(model, lang)}\x1e".encode("utf-8"))
+
+    for sentence in sentences:
+        # the separators can't occur in the words, so different sentences
+        # never result in the same bytes
+        key.update("\x1f".join(sentence).encode("utf-8"))
+        key.update(b"\x1e")
+
+    return key.hexdigest()
+
+
+class PredictionCache(object):
+    """On-disk cache of predicted labels, one compressed binary file per key.
+    The labels are stored as a small list of the different labels and one
+    array of label indexes, together with further information such as the
+    duration of the NER. If the size of the cache exceeds max_bytes, the
+    least recently used files are deleted.
+    """
+
+    def __init__(self, directory=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + ".bin")
+
+    def get(self, key, with_info=False):
+        """Return the cached labels of the given key, or None if there are no
+        labels stored for this key (with_info: return the labels and the 
+        dictionary with the further information)
+        """
+
+        path = self._path(key)
+
+        try:
+            with open(path, "rb") as infile:
+                data = zlib.decompress(infile.read())
+        except (OSError, zlib.error):
+            return None
+
+        if not data.startswith(MAGIC):
+            return None
+
+        start = len(MAGIC) + 4
+        (header_length,) = struct.unpack("<I", data[len(MAGIC):start])
+        header = json.loads(data[start:start + header_length].decode("utf-8"))
+        indexes = array(header["typecode"])
+        indexes.frombytes(data[start + header_length:])
+
+        # mark the file as recently used for the eviction
+        os.utime(path)
+
+        labels = header["labels"]
+        preds = [labels[i] for i in indexes]
+
+        if with_info:
+            return preds, header.get("info", {})
+        return preds
+
+    def put(self, key, preds, info=None):
+        """Store the given labels and the dictionary info with further 
+        information (e.g. the duration of the NER) under the given key
+        """
+
+        labels = sorted(set(preds))
+        label_ids = {label: i for i, label in enumerate(labels)}
+        typecode = "B" if len(labels) <= 256 else "H"
+        indexes = array(typecode, [label_ids[label] for label in preds])
+        header = json.dumps({"labels": labels, "typecode": typecode,
+                             "info": info or {}}).encode("utf-8")
+
+        data = MAGIC + struct.pack("<I", len(header)) + header + indexes.tobytes()
+
+        # write to a temporary file first, so that no half-written files are
+        # read by other processes
+        path = self._path(key)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as outfile:
+            outfile.write(zlib.compress(data))
+        os.replace(tmp_path, path)
+
+        self.evict()
+
+    def evict(self):
+        """Delete the least recently used files until the cache is not bigger
+        than max_bytes
+        """
+
+        files = []
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                if entry.name.endswith(".bin"):
+                    stat = entry.stat()
+                    files.append((stat.st_mtime, stat.st_size, entry.path))
+
+        total = sum(size for _, size, _ in files)
+
+        for _, size, path in sorted(files):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+
+    def clear(self):
+        """Delete all files of the cache"""
+
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                if entry.name.endswith(".bin"):
+                    os.remove(entry.path)
+
+
+def cached_ner(corpora, model, lang, predict, cache=None):
+    """Return the predicted labels of several corpora: the labels of the
+    corpora which are in the cache are taken from there, the NER of the other
+    corpora is performed with predict and their labels are stored in the
+    cache. All programs read and write the cache through this function.
+
+    args: corpora (dictionary, name -> list of sentences, each a list of
+    words), model (string, "spacy" or "stanza"), lang (string, "en" or "es"),
+    predict (function performing the NER, called with the dictionary of the
+    corpora which are not in the cache only, e.g. timed_ner() in 
+    parallel.py; it returns a dictionary, name -> (preds, duration)), cache
+    (PredictionCache, or None to always perform the NER)
+
+    return: dictionary, name of the corpus -> (preds, duration, cached),
+    where duration is the time of the NER in seconds and cached is True if
+    the labels were taken from the cache (the duration is then the one
+    measured when the labels were predicted, and has to be marked as such in
+    the reports)
+
+    note: predict is not called at all if all corpora are in the cache, so
+    no model is loaded then
+    """
+
+    results = {}
+    missing = {}
+    keys = {}
+
+    for name, sentences in corpora.items():
+        if cache is None:
+            missing[name] = sentences
+            continue
+        keys[name] = cache_key(sentences, model, lang)
+        cached = cache.get(keys[name], with_info=True)
+        if cached is None:
+            missing[name] = sentences
+        else:
+            preds, info = cached
+            results[name] = (preds, info.get("duration", 0.0), True)
+
+    if missing:
+        for name, (preds, duration) in predict(missing).items():
+            if cache is not None:
+                cache.put(keys[name], preds, {"duration": duration})
+            results[name] = (preds, duration, False)
+
+    # the results in the order of the given corpora
+    return {name: results[name] for name in corpora}
@@ -0,0 +1,132 @@
+"""Equivalence check of two NER backends
+
+Runs both backends on the chosen corpora and reports the sentences whose
+labels differ, e.g. to make sure that the spaCy pipelines with the NER
+components only predict the same labels as the full pipelines:
+
+    python check_backends.py --reference spacy --candidate spacy_ner
+                             --corpus europarl_en europarl_es
+
+The exit code is 1 if any labels differ.
+
+Backends which trade a small loss of accuracy for speed, e.g. the int8
+quantized Stanza models, are checked with --max-accuracy-drop instead: the
+accuracy of both backends is computed with eval_europarl() on the CoNLL
+corpora, and the exit code is 1 if the candidate is more than the given
+number of percentage points less accurate than the reference:
+
+    python check_backends.py --reference stanza --candidate stanza_int8
+                             --max-accuracy-drop 0.5
+"""
+
+import argparse
+import sys
+from time import perf_counter
+from backends import BACKENDS, compare_backends, get_model
+from benchmark import CORPORA, load_corpus, parent_dir_path
+from utils import load_europarl_sentences, ner_sentences, eval_europarl
+
+
+def check(reference, candidate, corpus):
+    """Compare the labels of two backends on one corpus
+
+    args: reference, candidate (strings, names of the backends), corpus
+    (string, key of CORPORA in benchmark.py)
+
+    return: differences (list of the indexes of the sentences with different
+    labels), sentences (list of all sentences of the corpus)
+    """
+
+    sentences, lang = load_corpus(corpus)
+
+    # the models are loaded first, so the loading time is not part of the
+    # time of the comparison
+    get_model(reference, lang)
+    get_model(candidate, lang)
+
+    start = perf_counter()
+    differences = compare_backends(reference, candidate, lang, sentences)
+    print(f"{corpus:<22}|{len(sentences):>6} sentences|"
+          f"{len(differences):>5} different|"
+          f"{round(perf_counter() - start, 2):>8} sec")
+
+    return differences, sentences
+
+
+def accuracy_regression(reference, candidate, corpus):
+    """Compare the accuracy and the speed of two backends on a CoNLL corpus
+
+    args: reference, candidate (strings, names of the backends), corpus
+    (string, key of a CoNLL corpus of CORPORA in benchmark.py)
+
+    return: dictionary, name of the backend -> (accuracy, tokens per second)
+    """
+
+    path, _, lang = CORPORA[corpus]
+    sentences, sentence_labels = load_europarl_sentences(f"{parent_dir_path}/{path}")
+    words = [word for sentence in sentences for word in sentence]
+    labels = [label for sentence in sentence_labels for label in sentence]
+    results = {}
+
+    for tool in (reference, candidate):
+        get_model(tool, lang)
+
+        start = perf_counter()
+        preds = ner_sentences(sentences, tool, lang)
+        duration = perf_counter() - start
+
+        accuracy, _ = eval_europarl(words, labels, preds, tool, with_differences=False)
+        results[tool] = (accuracy, len(words) / duration if duration else 0.0)
+
+    accuracy_a, speed_a = results[reference]
+    accuracy_b, speed_b = results[candidate]
+    print(f"{corpus:<22}|{reference} {round(accuracy_a * 100, 3)} % "
+          f"{round(speed_a, 1)} tokens/sec|{candidate} {round(accuracy_b * 100, 3)} % "
+          f"{round(speed_b, 1)} tokens/sec|"
+          f"delta {round((accuracy_b - accuracy_a) * 100, 3)} points")
+
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Equivalence check of two NER backends")
+    parser.add_argument("--reference", default="spacy", choices=sorted(BACKENDS))
+    parser.add_argument("--candidate", default="spacy_ner", choices=sorted(BACKENDS))
+    parser.add_argument("--corpus", nargs="+", default=["europarl_en", "europarl_es"],
+                        choices=sorted(CORPORA))
+    parser.add_argument("--show", type=int, default=5,
+                        help="number of differing sentences shown per corpus")
+    parser.add_argument("--max-accuracy-drop", type=float,
+                        help="compare the accuracy on the CoNLL corpora instead of the "
+                             "labels, allowed drop in percentage points")
+    args = parser.parse_args(argv)
+
+    if args.max_accuracy_drop is not None:
+        passed = True
+        for corpus in args.corpus:
+            if CORPORA[corpus][1] != "conll":
+                print(f"{corpus:<22}|skipped, no gold labels")
+                continue
+            results = accuracy_regression(args.reference, args.candidate, corpus)
+            drop = (results[args.reference][0] - results[args.candidate][0]) * 100
+            passed = passed and drop <= args.max_accuracy_drop
+
+        print("The accuracy is within the allowed drop." if passed
+              else "The accuracy dropped by more than the allowed drop.")
+
+        return 0 if passed else 1
+
+    equal = True
+    for corpus in args.corpus:
+        differences, sentences = check(args.reference, args.candidate, corpus)
+        for i in differences[:args.show]:
+            print(f"    sentence {i}: {' '.join(sentences[i])}")
+        equal = equal and not differences
+
+    print("The labels are the same." if equal else "The labels differ.")
+
+    return 0 if equal else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
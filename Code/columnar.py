@@ -0,0 +1,218 @@
+"""Compact columnar storage of corpora and predictions
+
+A corpus is stored as a folder of NumPy arrays, which are memory-mapped when
+the corpus is opened, so that no text has to be parsed again:
+
+    tokens.npy          token ids (int32), one per word
+    offsets.npy         start of each sentence in tokens.npy, plus the end
+    vocab.txt           the words, one per line, in the order of their ids
+    gold.npy/gold.txt   the gold label ids and the label vocabulary (optional)
+    pred_<name>.npy/.txt  the predicted labels of a model, e.g. "spacy_en"
+
+Slicing by sentences returns views into the memory-mapped arrays.
+"""
+
+from array import array
+import os
+import numpy as np
+from utils import (read_conll, iter_subtitle_words, split_sentences,
+                   postprocess_labels, get_backend_class)
+from evaluation import label_mask, compare_labels
+
+
+def _write_vocab(path, vocab):
+    with open(path, "w", encoding="utf-8", newline="\n") as outfile:
+        for entry in vocab:
+            outfile.write(entry + "\n")
+
+
+def _read_vocab(path):
+    with open(path, "r", encoding="utf-8", newline="\n") as infile:
+        return [line[:-1] for line in infile]
+
+
+def _encode(values, ids, ids_array):
+    """Append the ids of the values to ids_array, new values get new ids"""
+
+    for value in values:
+        if value not in ids:
+            ids[value] = len(ids)
+        ids_array.append(ids[value])
+
+
+def write_corpus(directory, sentences_with_labels):
+    """Write a corpus in the columnar format
+
+    args: directory (string, folder of the corpus, is created if needed),
+    sentences_with_labels (iterable of (words, labels) tuples, one per
+    sentence; labels may be None for corpora without gold labels)
+
+    return: directory
+    """
+
+    os.makedirs(directory, exist_ok=True)
+
+    token_ids = {}
+    label_ids = {}
+    tokens = array("i")
+    labels = array("H")
+    offsets = array("q", [0])
+
+    for words, sentence_labels in sentences_with_labels:
+        for word in words:
+            if "\n" in word:
+                raise ValueError(f"Words must not contain line breaks: {word!r}")
+        _encode(words, token_ids, tokens)
+        if sentence_labels is not None:
+            _encode(sentence_labels, label_ids, labels)
+        offsets.append(len(tokens))
+
+    np.save(os.path.join(directory, "tokens.npy"), np.frombuffer(tokens, dtype=np.int32))
+    np.save(os.path.join(directory, "offsets.npy"), np.frombuffer(offsets, dtype=np.int64))
+    _write_vocab(os.path.join(directory, "vocab.txt"), token_ids)
+
+    if labels:
+        np.save(os.path.join(directory, "gold.npy"), np.frombuffer(labels, dtype=np.uint16))
+        _write_vocab(os.path.join(directory, "gold.txt"), label_ids)
+
+    return directory
+
+
+def conll_to_columnar(filepath, directory, **kwargs):
+    """Convert a CoNLL file (e.g. a europarl conll02-file) into the columnar
+    format, the file is read sentence by sentence
+
+    args: filepath (string, full path of the file), directory (string,
+    folder of the corpus), kwargs (further arguments of read_conll())
+    """
+
+    return write_corpus(directory, read_conll(filepath, **kwargs))
+
+
+def subtitles_to_columnar(filepath, directory):
+    """Convert a movie subtitle txt-file into the columnar format, the words
+    are split into sentences after sentence-final punctuation marks
+
+    args: filepath (string, full path of the subtitle file), directory
+    (string, folder of the corpus)
+    """
+
+    sentences = split_sentences(iter_subtitle_words(filepath))
+    return write_corpus(directory, ((words, None) for words in sentences))
+
+
+class ColumnarCorpus(object):
+    """A corpus in the columnar format, opened with memory-mapped arrays"""
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.tokens = np.load(os.path.join(directory, "tokens.npy"), mmap_mode="r")
+        self.offsets = np.load(os.path.join(directory, "offsets.npy"), mmap_mode="r")
+        self.vocab = _read_vocab(os.path.join(directory, "vocab.txt"))
+
+    def __len__(self):
+        """Number of sentences"""
+        return len(self.offsets) - 1
+
+    @property
+    def n_tokens(self):
+        return len(self.tokens)
+
+    def _path(self, name):
+        return os.path.join(self.directory, f"{name}.npy"), \
+               os.path.join(self.directory, f"{name}.txt")
+
+    def _token_range(self, start, stop):
+        stop = len(self) if stop is None else min(stop, len(self))
+        return int(self.offsets[start]), int(self.offsets[stop])
+
+    def token_ids(self, start=0, stop=None):
+        """Token ids of the sentences start to stop (a view, no copy)"""
+
+        first, last = self._token_range(start, stop)
+        return self.tokens[first:last]
+
+    def label_ids(self, name="gold", start=0, stop=None):
+        """Label ids and label vocabulary of the gold labels ("gold") or of
+        stored predictions, for the sentences start to stop (a view, no copy)
+        """
+
+        array_path, vocab_path = self._path(name)
+        ids = np.load(array_path, mmap_mode="r")
+        first, last = self._token_range(start, stop)
+        return ids[first:last], _read_vocab(vocab_path)
+
+    def sentences(self, start=0, stop=None):
+        """Generator of the sentences start to stop as lists of words"""
+
+        stop = len(self) if stop is None else min(stop, len(self))
+        vocab = self.vocab
+
+        for i in range(start, stop):
+            ids = self.tokens[self.offsets[i]:self.offsets[i + 1]]
+            yield [vocab[token_id] for token_id in ids.tolist()]
+
+    def words(self, start=0, stop=None):
+        """List of all words of the sentences start to stop"""
+
+        vocab = self.vocab
+        return [vocab[token_id] for token_id in self.token_ids(start, stop).tolist()]
+
+    def labels(self, name="gold", start=0, stop=None):
+        """List of all labels (gold or predicted) of the sentences start to
+        stop
+        """
+
+        ids, vocab = self.label_ids(name, start, stop)
+        return [vocab[label_id] for label_id in ids.tolist()]
+
+    def label_masks(self, name="gold", start=0, stop=None, postprocess=False):
+        """Label masks (see evaluation.py) of the gold or predicted labels,
+        computed on the label vocabulary and then looked up for all words
+
+        args: name (string, "gold" or the name of stored predictions), start,
+        stop (range of sentences), postprocess (bool, transform SpaCy labels
+        with postprocess_labels() first)
+        """
+
+        ids, vocab = self.label_ids(name, start, stop)
+        if postprocess:
+            vocab = postprocess_labels(vocab)
+        masks = np.array([label_mask(label) for label in vocab], dtype=np.uint8)
+
+        return masks[ids]
+
+    def write_predictions(self, name, preds):
+        """Store predicted labels (list with one label per word of the
+        corpus) under the given name, e.g. "spacy_en"
+        """
+
+        if len(preds) != self.n_tokens:
+            raise ValueError(f"Expected {self.n_tokens} labels, got {len(preds)}")
+
+        label_ids = {}
+        ids = array("H")
+        _encode(preds, label_ids, ids)
+
+        array_path, vocab_path = self._path(f"pred_{name}")
+        np.save(array_path, np.frombuffer(ids, dtype=np.uint16))
+        _write_vocab(vocab_path, label_ids)
+
+
+def eval_columnar(corpus, pred_name, model, start=0, stop=None):
+    """Evaluate stored predictions of a columnar corpus against its gold
+    labels, in the same way as eval_europarl() in utils.py
+
+    args: corpus (ColumnarCorpus), pred_name (string, name of the stored
+    predictions), model (string, "spacy" or "stanza"), start, stop (range of
+    sentences)
+
+    return: accuracy (float), diff_indexes (numpy array of the indexes of the
+    differing words, relative to the first word of sentence start)
+    """
+
+    gold = corpus.label_masks("gold", start, stop)
+    pred = corpus.label_masks(f"pred_{pred_name}", start, stop,
+                              postprocess=get_backend_class(model).fine_grained)
+
+    return compare_labels(gold, pred)
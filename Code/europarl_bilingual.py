@@ -0,0 +1,54 @@
+from bilingual import run_bilingual
+from utils import preload_models
+from time import perf_counter
+from report import Report
+from profiling import stage
+import os
+
+# Get the full path of the directory where the current file is located
+dir_path = os.path.dirname(os.path.abspath(__file__))
+
+# get the parent directory path
+parent_dir_path = os.path.dirname(dir_path)
+parent_dir_path = parent_dir_path.replace('\\','/')
+
+# Paths of the parallel English and Spanish europarl-data
+path_en = f"{parent_dir_path}/Data/Europarl Corpus/en-europarl.test.conll02"
+path_es = f"{parent_dir_path}/Data/Europarl Corpus/es-europarl.test.conll02"
+
+# format of the reports: "txt", "csv" or "jsonl", with ".gz" for compressed
+# reports (e.g. "csv.gz"), see report.py
+REPORT_FORMAT = "txt"
+
+for model, name in (("spacy", "SpaCy"), ("stanza", "Stanza")):
+    # Load the models of both languages first, so that the loading time is
+    # not part of the measured time
+    preload_models([(model, "en"), (model, "es")])
+
+    # Perform the Named Entity Recognition on both languages at the same time
+    # and measure the time it takes
+    start = perf_counter()
+    results = run_bilingual(path_en, path_es, model)
+    stop = perf_counter()
+    duration = stop - start
+
+    # Print the results, the sentence pairs whose entities don't agree are
+    # listed as differences
+    columns = [("Pair", 8), ("Agreement", 15), ("English entities", 30),
+               ("Spanish entities", 30)]
+    differences = ([index, round(agreement * 100, 3),
+                    " ".join(f"{t}:{n}" for t, n in sorted(types_en.items())),
+                    " ".join(f"{t}:{n}" for t, n in sorted(types_es.items()))]
+                   for index, agreement, types_en, types_es in results["pairs"]
+                   if agreement < 1.0)
+
+    with stage("report"), Report(f"{parent_dir_path}/Evaluation Results/europarl_bilingual_{model}_eval.{REPORT_FORMAT}",
+                                 columns) as report:
+        report.summary([(f"Duration of the {name} NER (English and Spanish) in seconds", round(duration, 3), "sec")])
+        report.summary([(f"Accuracy of the {name} NER (English) in percent", round(results['accuracy_en'] * 100, 3), "%"),
+                        (f"Accuracy of the {name} NER (Spanish) in percent", round(results['accuracy_es'] * 100, 3), "%"),
+                        (f"Cross-lingual entity agreement of the {name} NER in percent", round(results['agreement'] * 100, 3), "%"),
+                        ("Cross-lingual entity agreement of the gold labels in percent", round(results['gold_agreement'] * 100, 3), "%")])
+        report.write_rows(differences)
+
+    print(f"{name} DONE!")
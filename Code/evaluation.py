@@ -0,0 +1,249 @@
+import numpy as np
+
+# entity types of the 4 label format, each gets one bit of a label mask, the
+# lowest bit stands for the non-entity label "O"
+ENTITY_TYPES = ("PER", "LOC", "ORG", "MISC")
+
+# table of all labels which were already encoded, label -> label mask
+_label_masks = {}
+
+
+def label_mask(label):
+    """Encode a label as a bit mask: bit 0 is set for "O", and one further
+    bit for each of the entity types PER, LOC, ORG and MISC which occurs in
+    the label
+
+    args: label (string)
+
+    return: mask (int)
+
+    note: two labels match in the sense of label_match() in utils.py if, and
+    only if, their masks have at least one bit in common
+    """
+
+    mask = 1 if label == "O" else 0
+
+    for i, entity_type in enumerate(ENTITY_TYPES):
+        if entity_type in label:
+            mask |= 2 << i
+
+    return mask
+
+
+def encode_labels(labels):
+    """Encode a list of labels as a compact array of label masks
+
+    args: labels (list of strings, or an array which is already encoded)
+
+    return: masks (numpy array of uint8, one label mask per label)
+    """
+
+    if isinstance(labels, np.ndarray):
+        return labels
+
+    table = _label_masks
+    for label in set(labels).difference(table):
+        table[label] = label_mask(label)
+
+    return np.fromiter((table[label] for label in labels), dtype=np.uint8,
+                       count=len(labels))
+
+
+def compare_labels(labels1, labels2):
+    """Compare two label sequences of the same length token by token
+
+    args: labels1, labels2 (lists of labels, or arrays of label masks
+    returned by encode_labels())
+
+    return: rate (float, share of the tokens with matching labels, i.e. the
+    accuracy resp. concordance, 0.0 without tokens), diff_indexes (numpy array with the indexes
+    of the tokens whose labels don't match)
+    """
+
+    masks1 = encode_labels(labels1)
+    masks2 = encode_labels(labels2)
+
+    matches = (masks1 & masks2) != 0
+    diff_indexes = np.flatnonzero(~matches)
+    rate = float(np.count_nonzero(matches)) / len(matches) if len(matches) else 0.0
+
+    return rate, diff_indexes
+
+
+def build_differences(diff_indexes, word_list, labels1, labels2):
+    """Create the human-readable list of the differing tokens
+
+    args: diff_indexes (indexes of the tokens, see compare_labels()),
+    word_list (list of all words), labels1, labels2 (lists of labels)
+
+    return: differences (list of lists, consisting of index, word and the two
+    labels)
+    """
+
+    return list(iter_differences(diff_indexes, word_list, labels1, labels2))
+
+
+def iter_differences(diff_indexes, word_list, labels1, labels2):
+    """Generator version of build_differences(), the rows are created one at
+    a time while they are written, see report.py
+    """
+
+    for index in diff_indexes.tolist():
+        yield [index, word_list[index], labels1[index], labels2[index]]
+
+
+def entity_type(label):
+    """Return the entity type (PER, LOC, ORG or MISC) of a label in the same
+    way as label_match() in utils.py, i.e. the first type which occurs in the
+    label, or None for "O" and all other labels
+    """
+
+    for name in ENTITY_TYPES:
+        if name in label:
+            return name
+
+    return None
+
+
+def _span_step(span, label, index):
+    """Process one label of a sequence in the BIO resp. BIOES format
+
+    args: span (list [start, type, finished] of the current entity, or None),
+    label (string, label of the current token), index (int, index of the
+    current token)
+
+    return: span (the current entity after this token, or None), closed 
+    (tuple (start, end, type) of the entity which ended before this token, 
+    or None)
+    """
+
+    current_type = entity_type(label)
+    prefix = label.split("-", 1)[0] if "-" in label else ""
+    closed = None
+
+    # the current entity ends with a non-entity, with the beginning of a new
+    # entity, with a change of the type, or after an E-/S- label
+    if span is not None and (current_type is None or prefix in ("B", "S")
+                             or span[2] or current_type != span[1]):
+        closed = (span[0], index, span[1])
+        span = None
+
+    # an I- or E- label without a preceding B- label begins an entity as well
+    if current_type is not None and span is None:
+        span = [index, current_type, False]
+
+    if span is not None and prefix in ("E", "S"):
+        span[2] = True
+
+    return span, closed
+
+
+def extract_entities(labels):
+    """Extract the Named Entities of a label sequence in the BIO resp. BIOES
+    format
+
+    args: labels (iterable of labels in the 4 label format)
+
+    return: entities (list of (start, end, type) tuples, end is the index 
+    after the last word of the entity)
+    """
+
+    entities = []
+    span = None
+    index = -1
+
+    for index, label in enumerate(labels):
+        span, closed = _span_step(span, label, index)
+        if closed is not None:
+            entities.append(closed)
+
+    if span is not None:
+        entities.append((span[0], index + 1, span[1]))
+
+    return entities
+
+
+def entity_scores(gold_labels, pred_labels):
+    """Compute the entity-level precision, recall and F1 of the predicted
+    labels and the confusion matrix of the entity types, in one pass over the
+    two label sequences
+
+    args: gold_labels, pred_labels (iterables of labels in the 4 label format
+    and in the BIO or BIOES format, i.e. spaCy labels have to be transformed
+    with postprocess_labels() first)
+
+    return: scores (dictionary, entity type resp. "micro" -> dictionary with
+    precision, recall, f1 and support [number of gold entities]), confusion
+    (dictionary, gold type -> predicted type -> number of entities with the
+    same boundaries; "O" stands for entities without a counterpart)
+
+    note: a predicted entity is correct if its boundaries and its type are 
+    the same as those of a gold entity
+    """
+
+    types = ENTITY_TYPES + ("O",)
+    confusion = {gold: {pred: 0 for pred in types} for gold in types}
+    gold_span = None
+    pred_span = None
+    index = 0
+
+    def count(gold_closed, pred_closed):
+        if gold_closed is not None and pred_closed is not None and \
+                gold_closed[:2] == pred_closed[:2]:
+            confusion[gold_closed[2]][pred_closed[2]] += 1
+            return
+        if gold_closed is not None:
+            confusion[gold_closed[2]]["O"] += 1
+        if pred_closed is not None:
+            confusion["O"][pred_closed[2]] += 1
+
+    for index, (gold, pred) in enumerate(zip(gold_labels, pred_labels)):
+        gold_span, gold_closed = _span_step(gold_span, gold, index)
+        pred_span, pred_closed = _span_step(pred_span, pred, index)
+        count(gold_closed, pred_closed)
+
+    # close the entities at the end of the sequences
+    end = index + 1
+    count(None if gold_span is None else (gold_span[0], end, gold_span[1]),
+          None if pred_span is None else (pred_span[0], end, pred_span[1]))
+
+    return scores_from_confusion(confusion), confusion
+
+
+def scores_from_confusion(confusion):
+    """Compute the entity-level precision, recall and F1 from a confusion
+    matrix of entity_scores(); the matrices of several files can be added
+    up first to get the scores of all files
+
+    args: confusion (dictionary, gold type -> predicted type -> number of
+    entities)
+
+    return: scores (dictionary, see entity_scores())
+    """
+
+    types = ENTITY_TYPES + ("O",)
+    scores = {}
+    for name in ENTITY_TYPES:
+        correct = confusion[name][name]
+        n_gold = sum(confusion[name][pred] for pred in types)
+        n_pred = sum(confusion[gold][name] for gold in types)
+        scores[name] = _prf(correct, n_gold, n_pred)
+
+    correct = sum(confusion[t][t] for t in ENTITY_TYPES)
+    n_gold = sum(confusion[g][p] for g in ENTITY_TYPES for p in types)
+    n_pred = sum(confusion[g][p] for g in types for p in ENTITY_TYPES)
+    scores["micro"] = _prf(correct, n_gold, n_pred)
+
+    return scores
+
+
+def _prf(correct, n_gold, n_pred):
+    """Return precision, recall, F1 and support as a dictionary"""
+
+    precision = correct / n_pred if n_pred else 0.0
+    recall = correct / n_gold if n_gold else 0.0
+    f1 = (2 * precision * recall / (precision + recall)
+          if precision + recall else 0.0)
+
+    return {"precision": precision, "recall": recall, "f1": f1,
+            "support": n_gold}
@@ -0,0 +1,422 @@
+"""Config-driven runner of the evaluations
+
+The experiments (corpora, languages, NLP tools and type of evaluation) are
+read from a YAML or TOML file, see experiments.yaml:
+
+    python experiments.py experiments.yaml
+    python experiments.py experiments.yaml --only europarl_en el_hoyo_en
+
+The runs are planned before they are executed: every corpus is read once, and
+the NER runs are grouped by language model, so that every model is loaded
+only once (resp. once per worker process) for all corpora it is used on and
+freed before the next model is loaded. Groups whose corpora can't be split
+by sentence (the subtitles) run at the same time in separate processes, see
+run_groups(). The reports are written to the Evaluation Results folder in the
+same way as by the single programs.
+"""
+
+import argparse
+import os
+from utils import (load_europarl_sentences, load_subtitles, eval_europarl,
+                   eval_europarl_entities, eval_subtitles, postprocess_labels,
+                   unload_models, get_backend_class, DEFAULT_BATCH_SIZE,
+                   DEFAULT_MAX_TOKENS)
+from subtitles import load_subtitle_cues
+from columnar import ColumnarCorpus
+from cache import PredictionCache, cached_ner
+from parallel import create_pool, timed_ner, run_ner_jobs, SHARDS_PER_WORKER
+from report import write_europarl_report, write_subtitles_report, write_cues_report
+from profiling import stage
+
+# Get the full path of the directory where the current file is located
+dir_path = os.path.dirname(os.path.abspath(__file__))
+
+# get the parent directory path
+parent_dir_path = os.path.dirname(dir_path)
+parent_dir_path = parent_dir_path.replace('\\','/')
+
+DEFAULT_CONFIG = os.path.join(dir_path, "experiments.yaml")
+
+DEFAULT_SETTINGS = {
+    "workers": 0,
+    "batch_size": DEFAULT_BATCH_SIZE,
+    "max_tokens": DEFAULT_MAX_TOKENS,
+    "threads_per_worker": 1,
+    "use_cache": True,
+    "report_format": "txt",
+    "output_dir": "Evaluation Results",
+}
+
+# "subtitles" are the .txt files of the Movie subtitles folder, "cues" are
+# SRT or WebVTT files (also in zip or gzip archives, see subtitles.py), and
+# "columnar" are corpora converted with columnar.py
+CORPUS_TYPES = ("conll", "subtitles", "cues", "columnar")
+EVALUATIONS = ("gold", "concordance")
+
+# names of the tools in the reports
+TOOL_NAMES = {"spacy": "SpaCy", "stanza": "Stanza"}
+
+
+def load_config(path):
+    """Read an experiment matrix from a YAML (.yaml, .yml) or TOML (.toml)
+    file
+
+    args: path (string, full path of the file)
+
+    return: config (dictionary with settings, corpora and experiments, see
+    validate_config())
+    """
+
+    if path.lower().endswith(".toml"):
+        import tomllib
+
+        with open(path, "rb") as infile:
+            config = tomllib.load(infile)
+    else:
+        import yaml
+
+        with open(path, "r", encoding="utf-8") as infile:
+            config = yaml.safe_load(infile)
+
+    return validate_config(config or {})
+
+
+def has_gold_labels(corpus):
+    """Whether a corpus of the experiment matrix has gold labels: CoNLL
+    corpora, and columnar corpora converted from them
+
+    args: corpus (dictionary with path, type and lang)
+    """
+
+    if corpus["type"] == "columnar":
+        return os.path.exists(os.path.join(parent_dir_path, corpus["path"], "gold.npy"))
+
+    return corpus["type"] == "conll"
+
+
+def validate_config(config):
+    """Check an experiment matrix and fill in the defaults
+
+    args: config (dictionary with "settings", "corpora" and "experiments",
+    see experiments.yaml)
+
+    return: config (dictionary, the settings completed with
+    DEFAULT_SETTINGS, and every experiment with a name, its tools and its
+    evaluation)
+
+    note: raises a ValueError for unknown corpora, corpus types, tools,
+    languages and evaluations
+    """
+
+    settings = {**DEFAULT_SETTINGS, **(config.get("settings") or {})}
+    corpora = config.get("corpora") or {}
+    experiments = []
+
+    for name, corpus in corpora.items():
+        if corpus.get("type") not in CORPUS_TYPES:
+            raise ValueError(f"Unknown type of the corpus {name!r}: {corpus.get('type')!r}")
+
+    for experiment in config.get("experiments") or []:
+        corpus = experiment.get("corpus")
+        if corpus not in corpora:
+            raise ValueError(f"Unknown corpus: {corpus!r}")
+
+        gold = has_gold_labels(corpora[corpus])
+        lang = corpora[corpus]["lang"]
+        tools = list(experiment.get("tools", ["spacy", "stanza"]))
+        evaluation = experiment.get("evaluation", "gold" if gold else "concordance")
+
+        for tool in tools:
+            if lang not in get_backend_class(tool).languages():
+                raise ValueError(f"Unknown language model: {tool!r} for language {lang!r}")
+
+        if evaluation not in EVALUATIONS:
+            raise ValueError(f"Unknown evaluation: {evaluation!r}")
+        if evaluation == "gold" and not gold:
+            raise ValueError(f"The corpus {corpus!r} has no gold labels")
+        if evaluation == "concordance" and sorted(tools) != ["spacy", "stanza"]:
+            raise ValueError("The concordance compares the tools spacy and stanza")
+
+        experiments.append({"name": experiment.get("name", corpus), "corpus": corpus,
+                            "tools": tools, "evaluation": evaluation})
+
+    return {"settings": settings, "corpora": corpora, "experiments": experiments}
+
+
+def plan_runs(experiments, corpora):
+    """Plan the NER runs of the experiments: every combination of tool and
+    corpus is predicted once, and the runs are grouped by language model
+
+    args: experiments (list of experiments, see validate_config()), corpora
+    (dictionary, name -> corpus)
+
+    return: list of ((tool, lang), [names of the corpora]) tuples, in the
+    order in which the models are first needed
+    """
+
+    groups = {}
+
+    for experiment in experiments:
+        lang = corpora[experiment["corpus"]]["lang"]
+        for tool in experiment["tools"]:
+            names = groups.setdefault((tool, lang), [])
+            if experiment["corpus"] not in names:
+                names.append(experiment["corpus"])
+
+    return list(groups.items())
+
+
+def read_corpus(corpus):
+    """Read one corpus of the experiment matrix
+
+    args: corpus (dictionary with path, type and lang)
+
+    return: dictionary with sentences (list of sentences, each a list of
+    words), words (list of all words) and labels (list of all gold labels,
+    None for subtitles); for "cues" also files (list of (name, word_cues)
+    tuples, one per subtitle file, see load_subtitle_cues()), for "columnar"
+    also columnar (the ColumnarCorpus, see columnar.py)
+
+    note: the words of a subtitle file form one single sentence, i.e. they
+    are processed as one continuous text in the same way as by ner(); an
+    archive with several SRT or WebVTT files gives one sentence per file
+    """
+
+    path = os.path.join(parent_dir_path, corpus["path"])
+
+    if corpus["type"] == "conll":
+        sentences, sentence_labels = load_europarl_sentences(path)
+        return {"sentences": sentences,
+                "words": [word for sentence in sentences for word in sentence],
+                "labels": [label for labels in sentence_labels for label in labels]}
+
+    if corpus["type"] == "columnar":
+        # the memory-mapped arrays are read without parsing any text
+        columnar = ColumnarCorpus(path)
+        sentences = list(columnar.sentences())
+        labels = columnar.labels() if has_gold_labels(corpus) else None
+        return {"sentences": sentences, "words": columnar.words(),
+                "labels": labels, "columnar": columnar}
+
+    if corpus["type"] == "cues":
+        sentences = []
+        files = []
+        for name, words, word_cues in load_subtitle_cues(path):
+            sentences.append(words)
+            files.append((name, word_cues))
+        return {"sentences": sentences,
+                "words": [word for sentence in sentences for word in sentence],
+                "labels": None, "files": files}
+
+    words, _ = load_subtitles(path)
+    return {"sentences": [words], "words": words, "labels": None}
+
+
+def predict_group(tool, lang, corpora, settings, cache=None):
+    """Perform the NER with one language model on several corpora, with one
+    pool of worker processes for all of them
+
+    args: tool (string, name of the backend), lang (string, language),
+    corpora (dictionary, name -> corpus as returned by read_corpus()),
+    settings (dictionary, see DEFAULT_SETTINGS), cache (PredictionCache, or
+    None to always perform the NER)
+
+    return: dictionary, name of the corpus -> (preds, duration, cached),
+    see cached_ner() in cache.py
+
+    note: the worker processes are started and load the model before the
+    time measurement starts, so the duration only covers the NER itself, as
+    without worker processes
+    """
+
+    n_workers = settings["workers"] or os.cpu_count() or 1
+
+    def predict(missing):
+        # the workers are only started if a corpus can be split into shards
+        n_shards = max(min(n_workers * SHARDS_PER_WORKER, len(sentences))
+                       for sentences in missing.values())
+        if n_workers <= 1 or n_shards <= 1:
+            return timed_ner(missing, tool, lang, settings["batch_size"],
+                             settings["max_tokens"])
+
+        with create_pool(tool, lang, min(n_workers, n_shards),
+                         settings["threads_per_worker"]) as executor:
+            return timed_ner(missing, tool, lang, settings["batch_size"],
+                             settings["max_tokens"], executor,
+                             n_workers * SHARDS_PER_WORKER)
+
+    return cached_ner({name: corpus["sentences"] for name, corpus in corpora.items()},
+                      tool, lang, predict, cache)
+
+
+def run_groups(groups, corpora, settings, cache=None):
+    """Perform the NER of the planned runs, see plan_runs(): the groups whose
+    corpora can be split by sentence are processed one after another, each
+    with all worker processes; the other groups, e.g. the subtitles, which
+    are processed as one continuous text, run at the same time in separate
+    processes, one per group
+
+    args: groups (list of ((tool, lang), [names of the corpora]) tuples),
+    corpora (dictionary, name -> corpus as returned by read_corpus()),
+    settings (dictionary, see DEFAULT_SETTINGS), cache (PredictionCache, or
+    None to always perform the NER)
+
+    return: dictionary, (tool, name of the corpus) -> (preds, duration, cached)
+    """
+
+    n_workers = settings["workers"] or os.cpu_count() or 1
+    predictions = {}
+    jobs = {}
+    sharded = []
+
+    for (tool, lang), names in groups:
+        if n_workers > 1 and all(len(corpora[name]["sentences"]) <= 1 for name in names):
+            jobs[(tool, lang)] = ({name: corpora[name]["sentences"] for name in names},
+                                  tool, lang)
+        else:
+            sharded.append(((tool, lang), names))
+
+    if jobs:
+        results = run_ner_jobs(jobs, min(n_workers, len(jobs)), cache,
+                               settings["batch_size"], settings["max_tokens"])
+        for (tool, lang), group_results in results.items():
+            for name, result in group_results.items():
+                predictions[(tool, name)] = result
+            print(f"{TOOL_NAMES.get(tool, tool)} ({lang}) DONE!")
+
+    for (tool, lang), names in sharded:
+        results = predict_group(tool, lang, {name: corpora[name] for name in names},
+                                settings, cache)
+        for name, result in results.items():
+            predictions[(tool, name)] = result
+
+        # the model is not needed by the later runs anymore
+        unload_models([(tool, lang)])
+        print(f"{TOOL_NAMES.get(tool, tool)} ({lang}) DONE!")
+
+    return predictions
+
+
+def evaluate(experiment, corpus, predictions, settings):
+    """Evaluate the predictions of one experiment and write its reports
+
+    args: experiment (dictionary, see validate_config()), corpus (dictionary,
+    see read_corpus()), predictions (dictionary, (tool, name of the corpus)
+    -> (preds, duration, cached)), settings (dictionary, see DEFAULT_SETTINGS)
+
+    return: list of the paths of the written reports
+    """
+
+    # absolute paths are kept as they are
+    output_dir = os.path.join(parent_dir_path, settings["output_dir"])
+    report_format = settings["report_format"]
+    name = experiment["name"]
+    words = corpus["words"]
+    paths = []
+
+    os.makedirs(output_dir, exist_ok=True)
+
+    if experiment["evaluation"] == "gold":
+        labels = corpus["labels"]
+        for tool in experiment["tools"]:
+            preds, duration, cached = predictions[(tool, experiment["corpus"])]
+            accuracy, differences = eval_europarl(words, labels, preds, tool, lazy=True)
+            scores, confusion = eval_europarl_entities(labels, preds, tool)
+
+            path = f"{output_dir}/{name}_{tool}_eval.{report_format}"
+            with stage("report"):
+                write_europarl_report(path, TOOL_NAMES.get(tool, tool), duration,
+                                      accuracy, scores, confusion, differences,
+                                      cached=cached)
+            paths.append(path)
+    else:
+        preds_spacy, duration_spacy, cached_spacy = predictions[("spacy", experiment["corpus"])]
+        preds_stanza, duration_stanza, cached_stanza = predictions[("stanza", experiment["corpus"])]
+        concordance, differences = eval_subtitles(words, preds_spacy, preds_stanza,
+                                                  lazy=True)
+
+        # the words of SRT and WebVTT files are decoded as UTF-8 if possible,
+        # those of the plain subtitle files as latin-1
+        encoding = "utf-8" if "files" in corpus else "latin-1"
+        path = f"{output_dir}/{name}_eval.{report_format}"
+        with stage("report"):
+            write_subtitles_report(path, duration_spacy, duration_stanza,
+                                   concordance, differences, encoding=encoding,
+                                   cached=(cached_spacy, cached_stanza))
+        paths.append(path)
+
+        # the labels of SRT and WebVTT files are mapped back to their cues
+        if "files" in corpus:
+            path = f"{output_dir}/{name}_cues.{report_format}"
+            with stage("report"):
+                write_cues_report(path, corpus["files"], words,
+                                  postprocess_labels(preds_spacy), preds_stanza)
+            paths.append(path)
+
+    return paths
+
+
+def run_experiments(config, names=None):
+    """Run the experiments of an experiment matrix: read the corpora, perform
+    the NER model by model, then evaluate and write the reports
+
+    args: config (dictionary, see load_config()), names (list of the names of
+    the experiments to run, all if None)
+
+    return: list of the paths of the written reports
+    """
+
+    settings = config["settings"]
+    experiments = [experiment for experiment in config["experiments"]
+                   if names is None or experiment["name"] in names]
+    cache = PredictionCache() if settings["use_cache"] else None
+
+    # every corpus is read once, even if several experiments use it
+    corpora = {}
+    for experiment in experiments:
+        if experiment["corpus"] not in corpora:
+            corpora[experiment["corpus"]] = read_corpus(config["corpora"][experiment["corpus"]])
+
+    predictions = run_groups(plan_runs(experiments, config["corpora"]), corpora,
+                             settings, cache)
+
+    # the predictions on columnar corpora are stored with them, e.g. for
+    # eval_columnar()
+    for (tool, name), (preds, _, _) in predictions.items():
+        if "columnar" in corpora[name]:
+            lang = config["corpora"][name]["lang"]
+            corpora[name]["columnar"].write_predictions(f"{tool}_{lang}", preds)
+
+    paths = []
+    for experiment in experiments:
+        paths.extend(evaluate(experiment, corpora[experiment["corpus"]],
+                              predictions, settings))
+
+    return paths
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run the NER experiments of a YAML or TOML file")
+    parser.add_argument("config", nargs="?", default=DEFAULT_CONFIG,
+                        help="path of the experiment matrix")
+    parser.add_argument("--only", nargs="+", metavar="NAME",
+                        help="names of the experiments to run")
+    parser.add_argument("--workers", type=int,
+                        help="number of worker processes, overrides the config")
+    parser.add_argument("--report-format",
+                        help="format of the reports, overrides the config")
+    args = parser.parse_args(argv)
+
+    config = load_config(args.config)
+    if args.workers is not None:
+        config["settings"]["workers"] = args.workers
+    if args.report_format is not None:
+        config["settings"]["report_format"] = args.report_format
+
+    for path in run_experiments(config, args.only):
+        print(f"Report written to {path}")
+
+
+# the main guard is needed by the worker processes of the NER
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,373 @@
+"""Incremental evaluation of a whole corpus directory
+
+All files of a directory, e.g. Data/Movie subtitles, are evaluated as one
+collection. A manifest (JSON) keeps the hash, size and modification time of
+every file together with its counts (number of words, matching labels and the
+entity confusion matrices), so a later run only performs the NER on new or
+modified files and computes the overall concordance resp. accuracy from the
+stored counts:
+
+    python incremental.py "Data/Movie subtitles" --evaluation concordance
+    python incremental.py "Data/Europarl Corpus" --evaluation gold
+
+A file is also evaluated again when the version of one of the language models
+changes. The predicted labels of the files are kept in the prediction cache
+(see cache.py).
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import re
+from utils import (eval_europarl, eval_europarl_entities, eval_subtitles,
+                   get_backend_class)
+from evaluation import scores_from_confusion, ENTITY_TYPES
+from cache import PredictionCache, model_version
+from experiments import (read_corpus, run_groups, DEFAULT_SETTINGS,
+                         TOOL_NAMES, parent_dir_path)
+from report import Report
+
+MANIFEST_VERSION = 1
+
+# file extensions of the corpora of each evaluation: the .txt subtitles, and
+# SRT and WebVTT files, also compressed or in zip archives (see subtitles.py)
+EXTENSIONS = {
+    "concordance": (".txt", ".srt", ".vtt", ".srt.gz", ".vtt.gz", ".zip"),
+    "gold": (".conll", ".conll02", ".conll03"),
+}
+
+
+def corpus_type(name, evaluation):
+    """Return the type of the corpus in a file (see read_corpus() in
+    experiments.py): "conll", "subtitles" for .txt files, "cues" for SRT and
+    WebVTT files and archives
+    """
+
+    if evaluation == "gold":
+        return "conll"
+    return "subtitles" if name.lower().endswith(".txt") else "cues"
+
+
+# language in the file name, e.g. "El Hoyo (EN).txt" or "es-europarl.test.conll02"
+_LANG_PATTERNS = (re.compile(r"\((\w\w)\)"), re.compile(r"^(\w\w)[-_.]"))
+
+
+def file_lang(name, lang=None):
+    """Return the language of a file: the given language, or the one in the
+    file name
+
+    note: raises a ValueError if the language can't be found
+    """
+
+    if lang is not None:
+        return lang
+
+    for pattern in _LANG_PATTERNS:
+        match = pattern.search(name)
+        if match:
+            return match.group(1).lower()
+
+    raise ValueError(f"No language found in the file name {name!r}, please give the language")
+
+
+def file_hash(path):
+    """SHA-256 hash of the content of a file, read in blocks"""
+
+    digest = hashlib.sha256()
+
+    with open(path, "rb") as infile:
+        for block in iter(lambda: infile.read(1 << 20), b""):
+            digest.update(block)
+
+    return digest.hexdigest()
+
+
+def load_manifest(path, evaluation, tools):
+    """Load the manifest of a directory, or return an empty one if there is
+    none yet or if it was made for another evaluation or other tools
+    """
+
+    empty = {"version": MANIFEST_VERSION, "evaluation": evaluation,
+             "tools": list(tools), "files": {}}
+
+    if not os.path.exists(path):
+        return empty
+
+    with open(path, "r", encoding="utf-8") as infile:
+        manifest = json.load(infile)
+
+    if manifest.get("version") != MANIFEST_VERSION or \
+            manifest.get("evaluation") != evaluation or \
+            manifest.get("tools") != list(tools):
+        return empty
+
+    return manifest
+
+
+def save_manifest(path, manifest):
+    """Write the manifest to a temporary file first and then replace the old
+    one, so an interrupted run never leaves a broken manifest behind
+    """
+
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+
+    with open(path + ".tmp", "w", encoding="utf-8") as outfile:
+        json.dump(manifest, outfile, indent=1, ensure_ascii=False)
+    os.replace(path + ".tmp", path)
+
+
+def _models(tools, lang):
+    """Names and versions of the language models, stored with the counts"""
+
+    return {tool: f"{get_backend_class(tool).model_name(lang)}/{model_version(tool, lang)}"
+            for tool in tools}
+
+
+def _file_counts(evaluation, corpus, preds, tools):
+    """Count the words, the matching labels and the entities of one file
+
+    args: evaluation (string, "concordance" or "gold"), corpus (see
+    read_corpus()), preds (dictionary, tool -> predicted labels), tools
+    (list of the names of the tools)
+
+    return: counts (dictionary, see the description of the module)
+    """
+
+    words = corpus["words"]
+
+    # files without words, e.g. subtitles without cues, are kept in the
+    # manifest with zero counts, aggregate() skips them
+    if not words:
+        if evaluation == "concordance":
+            return {"words": 0, "matches": 0}
+        types = ENTITY_TYPES + ("O",)
+        return {tool: {"words": 0, "matches": 0,
+                       "confusion": {gold: dict.fromkeys(types, 0) for gold in types}}
+                for tool in tools}
+
+    if evaluation == "concordance":
+        _, diff_indexes = eval_subtitles(words, preds["spacy"], preds["stanza"],
+                                         with_differences=False)
+        return {"words": len(words), "matches": len(words) - len(diff_indexes)}
+
+    counts = {}
+    for tool in tools:
+        _, diff_indexes = eval_europarl(words, corpus["labels"], preds[tool], tool,
+                                        with_differences=False)
+        _, confusion = eval_europarl_entities(corpus["labels"], preds[tool], tool)
+        counts[tool] = {"words": len(words), "matches": len(words) - len(diff_indexes),
+                        "confusion": confusion}
+
+    return counts
+
+
+def update_directory(directory, evaluation="concordance", tools=("spacy", "stanza"),
+                     lang=None, manifest_path=None, settings=None):
+    """Evaluate the new and modified files of a corpus directory and update
+    its manifest
+
+    args: directory (string, full path of the directory), evaluation (string,
+    "concordance" of SpaCy and Stanza on subtitle files, or "gold" for CoNLL
+    files), tools (names of the tools), lang (string, language of all files,
+    taken from the file names if None, see file_lang()), manifest_path
+    (string, path of the manifest, see default_paths()), settings
+    (dictionary, see DEFAULT_SETTINGS in experiments.py)
+
+    return: manifest (dictionary, "files": name -> hash, size, mtime, lang,
+    models and counts), changes (dictionary, "evaluated", "unchanged" and
+    "removed" -> lists of file names)
+    """
+
+    if evaluation not in EXTENSIONS:
+        raise ValueError(f"Unknown evaluation: {evaluation!r}")
+    if evaluation == "concordance" and sorted(tools) != ["spacy", "stanza"]:
+        raise ValueError("The concordance compares the tools spacy and stanza")
+
+    settings = {**DEFAULT_SETTINGS, **(settings or {})}
+    if manifest_path is None:
+        manifest_path = default_paths(directory, evaluation)[0]
+
+    manifest = load_manifest(manifest_path, evaluation, tools)
+    entries = manifest["files"]
+    names = sorted(name for name in os.listdir(directory)
+                   if name.lower().endswith(EXTENSIONS[evaluation]))
+    changes = {"evaluated": [], "unchanged": [],
+               "removed": sorted(set(entries) - set(names))}
+
+    for name in changes["removed"]:
+        del entries[name]
+
+    # find the new and modified files: the size and modification time are
+    # compared first, and the hash only if they differ
+    changed = {}
+    models_by_lang = {}
+    for name in names:
+        path = os.path.join(directory, name)
+        stat = os.stat(path)
+        name_lang = file_lang(name, lang)
+        if name_lang not in models_by_lang:
+            models_by_lang[name_lang] = _models(tools, name_lang)
+        models = models_by_lang[name_lang]
+        entry = entries.get(name)
+
+        if entry is not None and entry["models"] == models:
+            if entry["size"] == stat.st_size and entry["mtime"] == stat.st_mtime_ns:
+                changes["unchanged"].append(name)
+                continue
+            sha256 = file_hash(path)
+            if entry["sha256"] == sha256:
+                entry["mtime"] = stat.st_mtime_ns
+                changes["unchanged"].append(name)
+                continue
+        else:
+            sha256 = file_hash(path)
+
+        changed[name] = {"sha256": sha256, "size": stat.st_size,
+                         "mtime": stat.st_mtime_ns, "lang": name_lang,
+                         "models": models}
+
+    # every changed file is read once, and every model is loaded once for
+    # all changed files of its language
+    corpora = {name: read_corpus({"path": os.path.join(directory, name),
+                                  "type": corpus_type(name, evaluation)})
+               for name in changed}
+    cache = PredictionCache() if settings["use_cache"] else None
+    groups = [((tool, group_lang), [name for name, entry in changed.items()
+                                    if entry["lang"] == group_lang])
+              for tool in tools
+              for group_lang in sorted({entry["lang"] for entry in changed.values()})]
+
+    preds = {name: {} for name in changed}
+    for (tool, name), (labels, _, _) in run_groups(groups, corpora, settings, cache).items():
+        preds[name][tool] = labels
+
+    for name, entry in changed.items():
+        entry["counts"] = _file_counts(evaluation, corpora[name], preds[name], tools)
+        entries[name] = entry
+        changes["evaluated"].append(name)
+
+    manifest["files"] = dict(sorted(entries.items()))
+    save_manifest(manifest_path, manifest)
+
+    return manifest, changes
+
+
+def aggregate(manifest):
+    """Compute the overall concordance resp. accuracy and entity scores of
+    all files from the counts in the manifest
+
+    return: dictionary with words, and concordance (for "concordance") resp.
+    tool -> accuracy and entity scores (for "gold")
+    """
+
+    entries = manifest["files"].values()
+
+    if manifest["evaluation"] == "concordance":
+        words = sum(entry["counts"]["words"] for entry in entries)
+        matches = sum(entry["counts"]["matches"] for entry in entries)
+        return {"words": words, "concordance": matches / words if words else 0.0}
+
+    types = ENTITY_TYPES + ("O",)
+    results = {"words": sum(next(iter(entry["counts"].values()))["words"]
+                            for entry in entries)}
+
+    for tool in manifest["tools"]:
+        counts = [entry["counts"][tool] for entry in entries]
+        words = sum(count["words"] for count in counts)
+        confusion = {gold: {pred: sum(count["confusion"][gold][pred] for count in counts)
+                            for pred in types} for gold in types}
+        results[tool] = {
+            "accuracy": sum(count["matches"] for count in counts) / words if words else 0.0,
+            "scores": scores_from_confusion(confusion),
+        }
+
+    return results
+
+
+def default_paths(directory, evaluation):
+    """Default paths of the manifest and of the report of a directory, in the
+    Evaluation Results folder
+
+    return: manifest_path, report_path (without the extension of the format)
+    """
+
+    name = os.path.basename(os.path.normpath(directory)).replace(" ", "_").lower()
+    output_dir = os.path.join(parent_dir_path, "Evaluation Results")
+
+    return (os.path.join(output_dir, f"{name}_{evaluation}_manifest.json"),
+            os.path.join(output_dir, f"{name}_{evaluation}_eval"))
+
+
+def write_directory_report(path, manifest, results, changes):
+    """Write the overall results and one row per file
+
+    args: path (string, full path of the report, see report.py for the
+    formats), manifest, results (see aggregate()), changes (see
+    update_directory())
+    """
+
+    entries = manifest["files"]
+
+    if manifest["evaluation"] == "concordance":
+        columns = [("File", 40), ("Words", 10), ("Concordance", 15)]
+        rows = ([name, entry["counts"]["words"],
+                 round(entry["counts"]["matches"] / entry["counts"]["words"] * 100, 3)
+                 if entry["counts"]["words"] else 0.0]
+                for name, entry in entries.items())
+    else:
+        columns = [("File", 40), ("Words", 10)] + \
+            [(f"{TOOL_NAMES.get(tool, tool)} Accuracy", 18) for tool in manifest["tools"]]
+        rows = ([name, next(iter(entry["counts"].values()))["words"]] +
+                [round(entry["counts"][tool]["matches"] / entry["counts"][tool]["words"] * 100, 3)
+                 if entry["counts"][tool]["words"] else 0.0 for tool in manifest["tools"]]
+                for name, entry in entries.items())
+
+    with Report(path, columns, title="Files") as report:
+        report.summary([("Files", len(entries), ""),
+                        ("Evaluated in this run", len(changes["evaluated"]), ""),
+                        ("Unchanged", len(changes["unchanged"]), ""),
+                        ("Removed", len(changes["removed"]), "")], align=True)
+        if manifest["evaluation"] == "concordance":
+            report.summary([("Concordance of SpaCy and Stanza in percent",
+                             round(results["concordance"] * 100, 3), "%")])
+        else:
+            for tool in manifest["tools"]:
+                name = TOOL_NAMES.get(tool, tool)
+                report.summary([(f"Accuracy of the {name} NER in percent",
+                                 round(results[tool]["accuracy"] * 100, 3), "%"),
+                                (f"Entity-level F1 of the {name} NER in percent",
+                                 round(results[tool]["scores"]["micro"]["f1"] * 100, 3), "%")])
+        report.write_rows(rows)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Incremental evaluation of a corpus directory")
+    parser.add_argument("directory", help="path of the directory, relative to the repository")
+    parser.add_argument("--evaluation", default="concordance", choices=sorted(EXTENSIONS))
+    parser.add_argument("--tools", nargs="+", default=["spacy", "stanza"])
+    parser.add_argument("--lang", help="language of all files, taken from the file names otherwise")
+    parser.add_argument("--manifest", help="path of the manifest")
+    parser.add_argument("--workers", type=int, default=DEFAULT_SETTINGS["workers"])
+    parser.add_argument("--report-format", default=DEFAULT_SETTINGS["report_format"])
+    args = parser.parse_args(argv)
+
+    directory = os.path.join(parent_dir_path, args.directory)
+    manifest_path, report_path = default_paths(directory, args.evaluation)
+
+    manifest, changes = update_directory(directory, args.evaluation, args.tools, args.lang,
+                                         args.manifest or manifest_path,
+                                         {"workers": args.workers})
+    results = aggregate(manifest)
+
+    report_path = f"{report_path}.{args.report_format}"
+    write_directory_report(report_path, manifest, results, changes)
+
+    print(f"{len(changes['evaluated'])} files evaluated, {len(changes['unchanged'])} "
+          f"unchanged, {len(changes['removed'])} removed")
+    print(f"Report written to {report_path}")
+
+
+# the main guard is needed by the worker processes of the NER
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,345 @@
+from concurrent.futures import ProcessPoolExecutor
+from time import perf_counter
+import multiprocessing
+import os
+import threading
+from utils import (get_model, preload_models, ner_sentences,
+                   DEFAULT_BATCH_SIZE, DEFAULT_MAX_TOKENS)
+from cache import cached_ner
+import profiling
+
+# number of shards per worker process, more shards than workers keep all
+# processes busy when some shards take longer than others
+SHARDS_PER_WORKER = 4
+
+
+def _limit_threads(n_threads):
+    """Limit the number of threads of PyTorch (used by Stanza) in this
+    process, so that the processes running at the same time don't compete for
+    the same cores
+    """
+
+    try:
+        import torch
+        torch.set_num_threads(n_threads)
+    except ImportError:
+        pass
+
+
+def _init_worker(model, lang, threads_per_worker, ready=None, origin=None,
+                 trace_queue=None):
+    """Initializer of the worker processes: limit the number of threads of
+    PyTorch (used by Stanza) and load the language model once per process
+
+    args: model (string, "spacy" or "stanza"), lang (string, "en" or "es"),
+    threads_per_worker (int, number of threads each worker may use), ready
+    (Barrier, waited for once the model is loaded, see create_pool()),
+    origin (float, time origin of the trace of the main process, None if it
+    is not traced), trace_queue (queue for the stages of the model loading)
+    """
+
+    profiling.start_worker(origin)
+    _limit_threads(threads_per_worker)
+
+    try:
+        preload_models([(model, lang)])
+    except BaseException:
+        # the other workers and create_pool() must not wait for this one
+        if ready is not None:
+            ready.abort()
+        raise
+
+    if trace_queue is not None:
+        trace_queue.put(profiling.collect())
+
+    if ready is not None:
+        ready.wait()
+
+
+def _ner_shard(shard, model, lang, batch_size, max_tokens):
+    """Perform the NER on one shard of documents in a worker process
+
+    args: shard (list of documents, each a list of sentences), model, lang,
+    batch_size, max_tokens (see ner_sentences())
+
+    return: list of the predicted labels of each document in the shard, and
+    the stages recorded in the worker (see profiling.collect())
+    """
+
+    preds = [ner_sentences(document, model, lang, batch_size, max_tokens)
+             for document in shard]
+
+    return preds, profiling.collect()
+
+
+def split_shards(items, n_shards):
+    """Split a list into n_shards contiguous parts of (almost) equal length
+
+    args: items (list), n_shards (int, number of parts)
+
+    return: list of the parts (lists), empty parts are left out
+    """
+
+    n_shards = max(1, min(n_shards, len(items)))
+    size, rest = divmod(len(items), n_shards)
+    shards = []
+    start = 0
+
+    for i in range(n_shards):
+        # the first parts get one item more if the list can't be split evenly
+        stop = start + size + (1 if i < rest else 0)
+        shards.append(items[start:stop])
+        start = stop
+
+    return [shard for shard in shards if shard]
+
+
+def create_pool(model, lang, n_workers, threads_per_worker=1, wait=True):
+    """Create a pool of worker processes which load the given language model
+    once each, it can be used for several corpora with pool_ner()
+
+    args: model (string, "spacy" or "stanza"), lang (string, "en" or "es"),
+    n_workers (int, number of processes), threads_per_worker (int, number of
+    PyTorch threads of each worker), wait (bool, start all workers and wait
+    until each of them has loaded the model)
+
+    return: the pool (ProcessPoolExecutor), to be shut down by the caller
+
+    note: with wait, the start of the workers and the loading of the models
+    are over when the pool is returned, so they are not part of the time of
+    the NER measured afterwards
+    """
+
+    context = multiprocessing.get_context()
+    ready = context.Barrier(n_workers + 1) if wait else None
+    origin = profiling.worker_origin()
+    # the stages of the model loading are sent back by every worker
+    trace_queue = context.SimpleQueue() if wait and origin is not None else None
+    executor = ProcessPoolExecutor(max_workers=n_workers, mp_context=context,
+                                   initializer=_init_worker,
+                                   initargs=(model, lang, threads_per_worker, ready,
+                                             origin, trace_queue))
+
+    if wait:
+        # the workers are started on demand, one per task as long as none of
+        # them is idle, so n_workers tasks start all of them
+        futures = [executor.submit(os.getpid) for _ in range(n_workers)]
+        try:
+            ready.wait()
+        except threading.BrokenBarrierError:
+            # a worker could not load the model, its error is raised below
+            pass
+        try:
+            for future in futures:
+                future.result()
+        except BaseException:
+            executor.shutdown(cancel_futures=True)
+            raise
+
+        if trace_queue is not None:
+            for _ in range(n_workers):
+                profiling.merge(trace_queue.get())
+
+    return executor
+
+
+def _map_shards(shards, model, lang, executor, batch_size, max_tokens):
+    """Process the given shards with a pool of worker processes
+
+    args: shards (list of shards, each a list of documents), executor (pool
+    created with create_pool()), see parallel_ner_documents() for the other
+    arguments
+
+    return: list of the predicted labels of each document of all shards, in
+    the order of the shards
+    """
+
+    n = len(shards)
+
+    # executor.map returns the results in the order of the shards, so the
+    # output does not depend on which worker finishes first
+    results = executor.map(_ner_shard, shards, [model] * n, [lang] * n,
+                           [batch_size] * n, [max_tokens] * n)
+    preds = []
+    for shard_preds, recorded in results:
+        preds.extend(shard_preds)
+        profiling.merge(recorded)
+
+    return preds
+
+
+def pool_ner(executor, sentences, model, lang, n_shards,
+             batch_size=DEFAULT_BATCH_SIZE, max_tokens=DEFAULT_MAX_TOKENS):
+    """Perform the NER on the sentences of one corpus with an existing pool
+    of worker processes, the corpus is sharded by sentence
+
+    args: executor (pool created with create_pool() for the same model and
+    language), sentences (list of sentences, each a list of words), n_shards
+    (int, number of shards), see parallel_ner_documents() for the other
+    arguments
+
+    return: list of all predicted labels in the order of the corpus
+    """
+
+    # every shard of sentences is processed as one document by a worker
+    shards = [[shard] for shard in split_shards(sentences, n_shards)]
+    preds = _map_shards(shards, model, lang, executor, batch_size, max_tokens)
+
+    return [label for labels in preds for label in labels]
+
+
+def parallel_ner_documents(documents, model, lang, n_workers=None,
+                           batch_size=DEFAULT_BATCH_SIZE,
+                           max_tokens=DEFAULT_MAX_TOKENS, threads_per_worker=1):
+    """Perform the NER on several documents with a pool of worker processes,
+    the documents are sharded by document
+
+    args: documents (list of documents, each a list of sentences, each a list
+    of words), model (string, language model to be used i.e. spaCy or
+    Stanza), lang (string, language of the text), n_workers (int, number of
+    processes, all CPU cores if None), batch_size, max_tokens (int, see
+    ner_sentences()), threads_per_worker (int, number of PyTorch threads of each worker)
+
+    return: list of the predicted labels of each document, in the same order
+    as the given documents
+    """
+
+    documents = list(documents)
+
+    if n_workers is None:
+        n_workers = os.cpu_count() or 1
+
+    if n_workers <= 1 or len(documents) <= 1:
+        return [ner_sentences(document, model, lang, batch_size, max_tokens)
+                for document in documents]
+
+    shards = split_shards(documents, n_workers * SHARDS_PER_WORKER)
+
+    with create_pool(model, lang, min(n_workers, len(shards)),
+                     threads_per_worker) as executor:
+        return _map_shards(shards, model, lang, executor, batch_size, max_tokens)
+
+
+def parallel_ner(sentences, model, lang, n_workers=None,
+                 batch_size=DEFAULT_BATCH_SIZE, max_tokens=DEFAULT_MAX_TOKENS,
+                 threads_per_worker=1):
+    """Perform the NER on the sentences of one corpus with a pool of worker
+    processes, the corpus is sharded by sentence
+
+    args: sentences (list of sentences, each a list of words), see
+    parallel_ner_documents() for the other arguments
+
+    return: list of all predicted labels in the order of the corpus, the same
+    as returned by ner_sentences()
+    """
+
+    sentences = list(sentences)
+
+    if n_workers is None:
+        n_workers = os.cpu_count() or 1
+
+    if n_workers <= 1 or len(sentences) <= 1:
+        return ner_sentences(sentences, model, lang, batch_size, max_tokens)
+
+    n_shards = min(n_workers * SHARDS_PER_WORKER, len(sentences))
+
+    with create_pool(model, lang, min(n_workers, n_shards),
+                     threads_per_worker) as executor:
+        return pool_ner(executor, sentences, model, lang, n_shards, batch_size,
+                        max_tokens)
+
+
+def timed_ner(corpora, model, lang, batch_size=DEFAULT_BATCH_SIZE,
+              max_tokens=DEFAULT_MAX_TOKENS, executor=None, n_shards=None):
+    """Perform the NER with one language model on several corpora and
+    measure the time of each corpus
+
+    args: corpora (dictionary, name -> list of sentences, each a list of
+    words), model (string, "spacy" or "stanza"), lang (string, "en" or "es"),
+    batch_size, max_tokens (int, see ner_sentences()), executor (pool
+    created with create_pool() for the same model and language, or None to
+    perform the NER in this process), n_shards (int, number of shards of a
+    corpus for the pool)
+
+    return: dictionary, name of the corpus -> (preds, duration), where
+    duration is the time of the NER in seconds
+
+    note: without a pool the model is loaded before the time measurement
+    starts, so the duration only covers the NER itself
+    """
+
+    if executor is None:
+        get_model(model, lang)
+
+    results = {}
+
+    for name, sentences in corpora.items():
+        start = perf_counter()
+        if executor is None:
+            preds = ner_sentences(sentences, model, lang, batch_size, max_tokens)
+        else:
+            preds = pool_ner(executor, sentences, model, lang, n_shards,
+                             batch_size, max_tokens)
+        stop = perf_counter()
+        results[name] = (preds, stop - start)
+
+    return results
+
+
+def _run_job(corpora, model, lang, batch_size, max_tokens, cache, origin,
+             threads_per_job):
+    """Run one NER job in a worker process, see run_ner_jobs()
+
+    return: the results of the job, and the stages recorded in the worker
+    (see profiling.collect())
+    """
+
+    profiling.start_worker(origin)
+    _limit_threads(threads_per_job)
+
+    def predict(missing):
+        return timed_ner(missing, model, lang, batch_size, max_tokens)
+
+    return cached_ner(corpora, model, lang, predict, cache), profiling.collect()
+
+
+def run_ner_jobs(jobs, n_workers=None, cache=None, batch_size=DEFAULT_BATCH_SIZE,
+                 max_tokens=DEFAULT_MAX_TOKENS, threads_per_job=None):
+    """Run independent NER jobs, e.g. SpaCy and Stanza for English and 
+    Spanish, at the same time in separate processes
+
+    args: jobs (dictionary, name of the job -> (corpora, model, lang), where
+    corpora is a dictionary, name of the corpus -> list of sentences), 
+    n_workers (int, number of processes, one per job if None), cache 
+    (PredictionCache, or None to always perform the NER), batch_size, 
+    max_tokens (int, see ner_sentences()), threads_per_job (int, number of
+    PyTorch threads of each process, the cores divided by the number of
+    processes if None)
+
+    return: dictionary, name of the job -> dictionary, name of the corpus ->
+    (preds, duration, cached), see cached_ner() in cache.py
+
+    note: every process runs one job only and is ended afterwards, so it only
+    loads the one language model its job needs; the processes share the
+    cores, so each of them uses only its part of them for the NER
+    """
+
+    if n_workers is None:
+        n_workers = len(jobs)
+    if threads_per_job is None:
+        threads_per_job = max(1, (os.cpu_count() or 1) // max(1, n_workers))
+
+    origin = profiling.worker_origin()
+    results = {}
+
+    with ProcessPoolExecutor(max_workers=max(1, n_workers),
+                             max_tasks_per_child=1) as executor:
+        futures = {name: executor.submit(_run_job, corpora, model, lang,
+                                         batch_size, max_tokens, cache, origin,
+                                         threads_per_job)
+                   for name, (corpora, model, lang) in jobs.items()}
+        for name, future in futures.items():
+            results[name], recorded = future.result()
+            profiling.merge(recorded)
+
+    return results
@@ -0,0 +1,277 @@
+"""Profiling hooks for the stages of a run (load -> NER -> postprocess ->
+eval -> report)
+
+The stages are measured with the context manager stage() resp. the decorator
+traced(), and the numbers of tokens, sentences and batches with count(). The
+measurements are only taken when tracing is enabled, e.g. with the
+environment variable NER_TRACE:
+
+    NER_TRACE=trace.json python europarl_en.py
+
+writes a trace in the Chrome trace format (open it in chrome://tracing or
+https://ui.perfetto.dev) and prints a summary of the stages. Additionally,
+NER_PROFILE=cprofile and/or NER_PROFILE=tracemalloc (comma-separated) capture
+a cProfile profile (trace.json.prof) resp. the top memory allocations
+(trace.json.memory.txt).
+
+The worker processes of parallel.py record their stages and counters as well
+(see start_worker()), and the main process merges them into its trace with
+merge(), where each worker is shown as a process of its own.
+"""
+
+import atexit
+from contextlib import contextmanager
+from functools import wraps
+import json
+import os
+import threading
+from time import perf_counter
+
+_enabled = False
+_events = []
+_counters = {}
+_lock = threading.Lock()
+_origin = perf_counter()
+_profiler = None
+
+
+def enable():
+    """Start recording the stages and counters"""
+
+    global _enabled
+    _enabled = True
+
+
+def disable():
+    """Stop recording the stages and counters"""
+
+    global _enabled
+    _enabled = False
+
+
+def is_enabled():
+    return _enabled
+
+
+def reset():
+    """Delete all recorded stages and counters"""
+
+    with _lock:
+        _events.clear()
+        _counters.clear()
+
+
+def worker_origin():
+    """Return the time origin of the trace if tracing is enabled, to be given
+    to the worker processes (see start_worker()), None otherwise
+    """
+
+    return _origin if _enabled else None
+
+
+def start_worker(origin):
+    """Start recording in a worker process, with the time origin of the main
+    process, so that the stages of the worker can be merged into its trace
+
+    args: origin (float, see worker_origin(); nothing is recorded if None)
+    """
+
+    global _enabled, _origin
+
+    if origin is None:
+        return
+
+    # a forked worker has a copy of the stages of the main process
+    reset()
+    _origin = origin
+    _enabled = True
+
+
+def collect():
+    """Return and delete the stages and counters recorded so far, e.g. in a
+    worker process, to be merged into the trace of the main process with
+    merge(); None if tracing is not enabled
+    """
+
+    if not _enabled:
+        return None
+
+    with _lock:
+        recorded = {"events": list(_events), "counters": dict(_counters)}
+        _events.clear()
+        _counters.clear()
+
+    return recorded
+
+
+def merge(recorded):
+    """Add the stages and counters recorded in another process (see
+    collect()) to the trace and the counters of this process
+    """
+
+    if not _enabled or not recorded:
+        return
+
+    with _lock:
+        _events.extend(recorded["events"])
+        for name, value in recorded["counters"].items():
+            _counters[name] = _counters.get(name, 0) + value
+
+
+def _timestamp(seconds):
+    # the Chrome trace format uses microseconds
+    return (seconds - _origin) * 1e6
+
+
+@contextmanager
+def stage(name, **args):
+    """Measure the duration of a stage, e.g. with stage("ner", tokens=100):
+
+    args: name (string, name of the stage), args (further information about
+    the stage, e.g. numbers of tokens, shown in the trace)
+    """
+
+    if not _enabled:
+        yield
+        return
+
+    start = perf_counter()
+    try:
+        yield
+    finally:
+        duration = perf_counter() - start
+        event = {"name": name, "cat": "stage", "ph": "X",
+                 "ts": _timestamp(start), "dur": duration * 1e6,
+                 "pid": os.getpid(), "tid": threading.get_ident(),
+                 "args": args}
+        with _lock:
+            _events.append(event)
+
+
+def traced(name):
+    """Decorator measuring each call of a function as the given stage"""
+
+    def decorator(function):
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return function(*args, **kwargs)
+            with stage(name, function=function.__name__):
+                return function(*args, **kwargs)
+        return wrapper
+
+    return decorator
+
+
+def count(name, value=1):
+    """Add value to the counter with the given name, e.g. "tokens" """
+
+    if not _enabled:
+        return
+
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + value
+        _events.append({"name": name, "cat": "counter", "ph": "C",
+                        "ts": _timestamp(perf_counter()), "pid": os.getpid(),
+                        "args": {name: _counters[name]}})
+
+
+def summary():
+    """Return the total duration and the number of calls of each stage, and
+    the values of the counters
+
+    note: the stages of the worker processes are included, so the seconds
+    of a stage can exceed the time it took in the main process
+
+    return: dictionary with "stages" (name -> {"calls", "seconds"}) and
+    "counters" (name -> value)
+    """
+
+    stages = {}
+    with _lock:
+        for event in _events:
+            if event["ph"] == "X":
+                totals = stages.setdefault(event["name"], {"calls": 0, "seconds": 0.0})
+                totals["calls"] += 1
+                totals["seconds"] += event["dur"] / 1e6
+        counters = dict(_counters)
+
+    return {"stages": stages, "counters": counters}
+
+
+def export_chrome_trace(path):
+    """Write all recorded stages and counters as a trace in the Chrome trace
+    format (JSON)
+    """
+
+    with _lock:
+        events = list(_events)
+
+    with open(path, "w", encoding="utf-8") as outfile:
+        json.dump({"traceEvents": events, "displayTimeUnit": "ms",
+                   "otherData": summary()}, outfile)
+
+
+def start_capture(cprofile=False, memory=False):
+    """Start capturing a cProfile profile and/or the memory allocations"""
+
+    global _profiler
+
+    if cprofile:
+        import cProfile
+        _profiler = cProfile.Profile()
+        _profiler.enable()
+
+    if memory:
+        import tracemalloc
+        tracemalloc.start()
+
+
+def stop_capture(prefix):
+    """Stop the captures of start_capture() and write the results to
+    <prefix>.prof (cProfile, readable with pstats or snakeviz) and
+    <prefix>.memory.txt (the 30 lines with the most allocated memory)
+    """
+
+    global _profiler
+
+    if _profiler is not None:
+        _profiler.disable()
+        _profiler.dump_stats(f"{prefix}.prof")
+        _profiler = None
+
+    import tracemalloc
+    if tracemalloc.is_tracing():
+        snapshot = tracemalloc.take_snapshot()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        with open(f"{prefix}.memory.txt", "w", encoding="utf-8") as outfile:
+            outfile.write(f"Peak traced memory: {round(peak / 1024 / 1024, 3)} MB\n\n")
+            for statistic in snapshot.statistics("lineno")[:30]:
+                outfile.write(f"{statistic}\n")
+
+
+def _finish(path):
+    stop_capture(path)
+    export_chrome_trace(path)
+
+    print(f"Trace written to {path}")
+    for name, totals in summary()["stages"].items():
+        print(f"{name:<15}|{totals['calls']:>8} calls|{round(totals['seconds'], 3):>10} sec")
+    counters = summary()["counters"]
+    for name, value in counters.items():
+        print(f"{name:<15}|{value:>8}")
+    if counters.get("padded_tokens"):
+        print(f"{'batch fill':<15}|{round(counters['tokens'] / counters['padded_tokens'], 3):>8}")
+
+
+# enable the tracing with environment variables, see the description above
+# (only in the main process: the worker processes inherit the environment,
+# and a spawned worker imports this module before parent_process() is set,
+# so the main process marks itself in the environment)
+if os.environ.get("NER_TRACE") and \
+        os.environ.setdefault("NER_TRACE_PID", str(os.getpid())) == str(os.getpid()):
+    enable()
+    _modes = os.environ.get("NER_PROFILE", "").split(",")
+    start_capture(cprofile="cprofile" in _modes, memory="tracemalloc" in _modes)
+    atexit.register(_finish, os.environ["NER_TRACE"])
@@ -0,0 +1,311 @@
+"""Streamed writing of the evaluation reports (Evaluation Results folder)
+
+A report consists of a summary (e.g. duration and accuracy), optional small
+tables (e.g. the entity-level scores) and one streamed table, usually the
+differences between two lists of labels. The rows of the streamed table are
+consumed lazily from an iterator and written to a temporary file, so the
+memory use does not depend on the number of rows; the summary can be set
+while or after the rows are written and ends up at the top of the file.
+
+The format is taken from the extension of the path:
+
+    .txt    fixed-width text, as in the original reports
+    .csv    the streamed table as CSV, summary and tables as # comment lines
+    .jsonl  one JSON object with the summary and tables, then one per row
+
+and a further .gz compresses the report with gzip, e.g. "report.csv.gz".
+"""
+
+import csv
+import gzip
+import json
+import shutil
+import tempfile
+from evaluation import extract_entities
+from subtitles import labels_by_cue, format_timestamp
+
+# size of the write buffers in bytes
+BUFFER_SIZE = 1 << 20
+
+FORMATS = ("txt", "csv", "jsonl")
+
+
+def _split_format(path):
+    """Return the format ("txt", "csv" or "jsonl") and whether the report is
+    compressed, taken from the extension of path
+    """
+
+    compress = path.endswith(".gz")
+    name = path[:-3] if compress else path
+    extension = name.rpartition(".")[2].lower()
+
+    if extension not in FORMATS:
+        raise ValueError(f"Unknown report format: {extension!r}, use one of {FORMATS}")
+
+    return extension, compress
+
+
+def _table_lines(title, columns, rows, rule=True):
+    """Format a table as fixed-width text lines
+
+    args: title (string), columns (list of (name, width) tuples, width None
+    for a column without padding), rows (iterable of rows), rule (bool, draw
+    a line below the column names)
+    """
+
+    def line(values):
+        return "|".join(f"{value:<{width}}" if width else f"{value}"
+                        for value, (_, width) in zip(values, columns))
+
+    header = line([name for name, _ in columns])
+    yield f"{title}:"
+    yield header
+    if rule:
+        yield "-" * len(header)
+    for row in rows:
+        yield line(row)
+
+
+class Report(object):
+    """Streamed writer of one report, used as a context manager:
+
+        with Report(path, columns, title="Differences") as report:
+            report.summary([("Accuracy of the SpaCy NER in percent", 98.1, "%")])
+            report.write_rows(differences)
+
+    args: path (string, full path of the report, see the description of the
+    module for the formats), columns (list of (name, width) tuples of the
+    streamed table), title (string, title of the streamed table), encoding
+    (string, encoding of the file)
+    """
+
+    def __init__(self, path, columns, title="Differences", encoding="utf-8"):
+        self.path = path
+        self.format, self.compress = _split_format(path)
+        self.columns = columns
+        self.title = title
+        self.encoding = encoding
+        self.n_rows = 0
+        self._paragraphs = []
+        self._tables = []
+
+        # the rows are written to a temporary file first, so the summary can
+        # be written above them once it is known
+        self._rows = tempfile.TemporaryFile("w+", encoding=encoding,
+                                            buffering=BUFFER_SIZE)
+        self._csv = csv.writer(self._rows, lineterminator="\n") \
+            if self.format == "csv" else None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self._rows.close()
+
+    def summary(self, items, align=False):
+        """Add a paragraph to the summary
+
+        args: items (list of (label, value, unit) tuples, e.g. ("Duration of
+        the SpaCy NER in seconds", 1.234, "sec")), align (bool, align the
+        values of the paragraph in the text format)
+        """
+
+        self._paragraphs.append((list(items), align))
+
+    def table(self, title, columns, rows, rule=True):
+        """Add a small table, which is kept in memory, e.g. the entity-level
+        scores
+
+        args: title (string), columns (list of (name, width) tuples), rows
+        (list of rows, each a list of values), rule (bool, draw a line below
+        the column names in the text format)
+        """
+
+        self._tables.append((title, columns, [list(row) for row in rows], rule))
+
+    def write_rows(self, rows):
+        """Write the rows of the streamed table, consumed lazily
+
+        args: rows (iterable of rows, each a sequence of values in the order
+        of the columns)
+        """
+
+        names = [name for name, _ in self.columns]
+
+        if self.format == "txt":
+            widths = [width for _, width in self.columns]
+            for row in rows:
+                self._rows.write("|".join(f"{value:<{width}}" if width else f"{value}"
+                                          for value, width in zip(row, widths)) + "\n")
+                self.n_rows += 1
+        elif self.format == "csv":
+            for row in rows:
+                self._csv.writerow(row)
+                self.n_rows += 1
+        else:
+            for row in rows:
+                self._rows.write(json.dumps(dict(zip(names, row)), ensure_ascii=False) + "\n")
+                self.n_rows += 1
+
+    def _header_lines(self):
+        """Lines of the summary and the tables in the text format"""
+
+        for items, align in self._paragraphs:
+            width = max(len(label) for label, _, _ in items) + 1 if align else 0
+            for label, value, unit in items:
+                yield f"{label + ':':<{width}} {value} {unit}".rstrip()
+            yield ""
+
+        for title, columns, rows, rule in self._tables:
+            yield from _table_lines(title, columns, rows, rule)
+            yield ""
+
+    def _open(self):
+        if self.compress:
+            return gzip.open(self.path, "wt", encoding=self.encoding)
+        return open(self.path, "w", encoding=self.encoding, buffering=BUFFER_SIZE)
+
+    def close(self):
+        """Write the summary, the tables and the streamed rows to the report"""
+
+        names = [name for name, _ in self.columns]
+
+        with self._open() as outfile:
+            if self.format == "txt":
+                for line in self._header_lines():
+                    outfile.write(line + "\n")
+                for line in _table_lines(self.title, self.columns, []):
+                    outfile.write(line + "\n")
+            elif self.format == "csv":
+                for line in self._header_lines():
+                    outfile.write(f"# {line}".rstrip() + "\n")
+                outfile.write(",".join(names) + "\n")
+            else:
+                header = {
+                    "summary": [{"label": label, "value": value, "unit": unit}
+                                for items, _ in self._paragraphs
+                                for label, value, unit in items],
+                    "tables": {title: [dict(zip([name for name, _ in columns], row))
+                                       for row in rows]
+                               for title, columns, rows, _ in self._tables},
+                    "rows": self.n_rows,
+                }
+                outfile.write(json.dumps(header, ensure_ascii=False) + "\n")
+
+            self._rows.seek(0)
+            shutil.copyfileobj(self._rows, outfile, BUFFER_SIZE)
+
+        self._rows.close()
+
+
+def _seconds(cached):
+    """Unit of a duration: durations taken from the prediction cache were
+    measured in an earlier run, and are marked as cached
+    """
+
+    return "sec (cached)" if cached else "sec"
+
+
+def write_europarl_report(path, name, duration, accuracy, scores, confusion,
+                          differences, encoding="utf-8", cached=False):
+    """Write the report of the evaluation of one NLP tool on a europarl-file
+
+    args: path (string, full path of the report), name (string, name of the
+    tool, e.g. "SpaCy"), duration (float, seconds), accuracy (float), scores,
+    confusion (see eval_europarl_entities()), differences (iterable of
+    [index, word, gold label, prediction], see eval_europarl()), encoding
+    (string, encoding of the file), cached (bool, the labels and the
+    duration were taken from the prediction cache)
+    """
+
+    columns = [("Index", 8), ("Word", 25), ("Gold Label", 15), ("Prediction", 15)]
+
+    with Report(path, columns, encoding=encoding) as report:
+        report.summary([(f"Duration of the {name} NER in seconds", round(duration, 3),
+                         _seconds(cached))])
+        report.summary([(f"Accuracy of the {name} NER in percent", round(accuracy * 100, 3), "%")])
+        report.table("Entity-level scores in percent",
+                     [("Type", 8), ("Precision", 15), ("Recall", 15), ("F1", 15), ("Support", None)],
+                     [[entity_type, round(score["precision"] * 100, 3),
+                       round(score["recall"] * 100, 3), round(score["f1"] * 100, 3),
+                       score["support"]] for entity_type, score in scores.items()])
+        report.table("Confusion matrix of the entity types (rows: gold, columns: prediction)",
+                     [("", 8)] + [(pred, 8) for pred in confusion],
+                     [[gold] + list(row.values()) for gold, row in confusion.items()],
+                     rule=False)
+        report.write_rows(differences)
+
+
+def write_subtitles_report(path, duration_spacy, duration_stanza, concordance,
+                           differences, encoding="latin-1", cached=(False, False)):
+    """Write the report of the comparison of SpaCy and Stanza on a subtitle
+    file
+
+    args: path (string, full path of the report), duration_spacy,
+    duration_stanza (floats, seconds), concordance (float), differences
+    (iterable of [index, word, SpaCy label, Stanza label], see
+    eval_subtitles()), encoding (string, encoding of the file), cached
+    (pair of bools, the labels of SpaCy resp. Stanza were taken from the
+    prediction cache)
+    """
+
+    columns = [("Index", 8), ("Word", 25), ("Spacy Label", 15), ("Stanza Label", 15)]
+
+    with Report(path, columns, encoding=encoding) as report:
+        report.summary([("Duration of the SpaCy NER in seconds", round(duration_spacy, 3),
+                         _seconds(cached[0])),
+                        ("Duration of the Stanza NER in seconds", round(duration_stanza, 3),
+                         _seconds(cached[1]))],
+                       align=True)
+        report.summary([("Concordance of SpaCy and Stanza in percent", round(concordance * 100, 3), "%")])
+        report.write_rows(differences)
+
+
+def _cue_entities(words_labels):
+    """Format the entities of a cue, e.g. "Marty (PER); Hill Valley (LOC)"
+
+    args: words_labels (list of (word, label) tuples of the cue)
+    """
+
+    words = [word for word, _ in words_labels]
+    return "; ".join(f"{' '.join(words[start:end])} ({entity_type})"
+                     for start, end, entity_type in
+                     extract_entities([label for _, label in words_labels]))
+
+
+def write_cues_report(path, files, words, spacy_labels, stanza_labels,
+                      encoding="utf-8"):
+    """Write the labels of SpaCy and Stanza on SRT resp. WebVTT files cue by
+    cue: one row per cue with its timestamps, its text and the entities
+    recognized by each tool
+
+    args: path (string, full path of the report), files (list of (name,
+    word_cues) tuples, see read_corpus() in experiments.py), words (list of
+    all words of the files), spacy_labels, stanza_labels (lists of the
+    labels of all words in the 4 label format), encoding (string, encoding of
+    the file)
+    """
+
+    columns = [("File", 30), ("Cue", 6), ("Start", 14), ("End", 14), ("Text", 60),
+               ("SpaCy Entities", 40), ("Stanza Entities", None)]
+
+    def rows():
+        start = 0
+        for name, word_cues in files:
+            stop = start + len(word_cues)
+            cues_spacy = labels_by_cue(words[start:stop], word_cues, spacy_labels[start:stop])
+            cues_stanza = labels_by_cue(words[start:stop], word_cues, stanza_labels[start:stop])
+            for (cue, labels_spacy), (_, labels_stanza) in zip(cues_spacy, cues_stanza):
+                yield [name, cue.index, format_timestamp(cue.start), format_timestamp(cue.end),
+                       " ".join(cue.lines), _cue_entities(labels_spacy),
+                       _cue_entities(labels_stanza)]
+            start = stop
+
+    with Report(path, columns, title="Cues", encoding=encoding) as report:
+        report.summary([("Files", len(files), ""),
+                        ("Cues", sum(len({id(cue) for cue in word_cues})
+                                     for _, word_cues in files), "")], align=True)
+        report.write_rows(rows())
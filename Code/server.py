@@ -0,0 +1,300 @@
+"""Local NER service
+
+Loads the spaCy and Stanza pipelines once and answers HTTP requests on
+localhost. Concurrent requests for the same model are grouped into
+micro-batches. Example:
+
+    python server.py --port 8080 --models spacy:en stanza:es
+
+    POST /ner  {"lang": "en", "tool": "spacy", "text": "Marty goes to Hill Valley."}
+    POST /ner  {"lang": "es", "tool": "stanza", "tokens": ["Vive", "en", "Madrid"]}
+
+The answer contains the words and their labels in the 4 label format (PER,
+LOC, ORG, MISC), i.e. the spaCy labels are transformed with
+postprocess_labels().
+"""
+
+import argparse
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import json
+from time import monotonic
+from utils import (get_model, preload_models, iter_ner, postprocess_labels,
+                   tokenize, split_sentences, DEFAULT_BATCH_SIZE)
+
+# default maximum time in seconds a request waits for further requests, before
+# its micro-batch is processed
+DEFAULT_MAX_WAIT = 0.01
+
+# maximum size of a request body in bytes
+MAX_BODY_BYTES = 10 * 1024 * 1024
+
+REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found",
+           405: "Method Not Allowed", 413: "Payload Too Large",
+           500: "Internal Server Error"}
+
+
+class MicroBatcher(object):
+    """Collects the requests for one language model and processes them
+    together: a batch is processed as soon as it contains max_batch_size
+    sentences, or when its oldest request has waited max_wait seconds.
+    The model itself runs in a separate thread, so that the server can accept
+    further requests in the meantime.
+    """
+
+    def __init__(self, model, lang, max_batch_size=DEFAULT_BATCH_SIZE,
+                 max_wait=DEFAULT_MAX_WAIT):
+        self.model = model
+        self.lang = lang
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.queue = asyncio.Queue()
+        # one thread per model, the pipelines are not used concurrently
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.task = asyncio.get_running_loop().create_task(self._run())
+
+    async def predict(self, sentences):
+        """Return the labels of the given sentences (list of lists of words)
+        once the micro-batch containing them has been processed
+
+        return: list of the labels of each sentence
+        """
+
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((sentences, future))
+        return await future
+
+    async def _collect(self):
+        """Wait for the next request and collect further requests until the
+        batch is full or the deadline of the first request has passed
+        """
+
+        items = [await self.queue.get()]
+        n_sentences = len(items[0][0])
+        deadline = monotonic() + self.max_wait
+
+        while n_sentences < self.max_batch_size:
+            timeout = deadline - monotonic()
+            if timeout <= 0:
+                break
+            try:
+                item = await asyncio.wait_for(self.queue.get(), timeout)
+            except asyncio.TimeoutError:
+                break
+            items.append(item)
+            n_sentences += len(item[0])
+
+        return items
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+
+        while True:
+            items = await self._collect()
+            sentences = [sentence for request, _ in items for sentence in request]
+
+            try:
+                preds = await loop.run_in_executor(self.executor, self._predict,
+                                                   sentences)
+            except Exception as error:
+                for _, future in items:
+                    if not future.done():
+                        future.set_exception(error)
+                continue
+
+            # every request gets the labels of its own sentences back, a
+            # sentence whose labels don't match its words only fails its own
+            # request
+            start = 0
+            for request, future in items:
+                request_preds = preds[start:start + len(request)]
+                start += len(request)
+                if future.done():
+                    continue
+                if any(len(labels) != len(sentence)
+                       for sentence, labels in zip(request, request_preds)):
+                    future.set_exception(ValueError("the number of labels does not "
+                                                    "match the number of words"))
+                else:
+                    future.set_result(request_preds)
+
+    def _predict(self, sentences):
+        """Return the list of the labels of each sentence, in the 4 label
+        format
+        """
+
+        preds = list(iter_ner(sentences, self.model, self.lang,
+                              self.max_batch_size))
+        if get_model(self.model, self.lang).fine_grained:
+            preds = [postprocess_labels(labels) for labels in preds]
+        return preds
+
+    def close(self):
+        self.task.cancel()
+        self.executor.shutdown(wait=False)
+
+
+class NERServer(object):
+    """HTTP server answering NER requests, see the description of the module"""
+
+    def __init__(self, models, max_batch_size=DEFAULT_BATCH_SIZE,
+                 max_wait=DEFAULT_MAX_WAIT):
+        # (model, lang) pairs which are available, the pipelines are loaded
+        # when the server starts
+        self.models = [tuple(pair) for pair in models]
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.batchers = {}
+        self.server = None
+
+    async def start(self, host="127.0.0.1", port=8080):
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, preload_models, self.models)
+
+        for model, lang in self.models:
+            self.batchers[(model, lang)] = MicroBatcher(model, lang,
+                                                        self.max_batch_size,
+                                                        self.max_wait)
+
+        self.server = await asyncio.start_server(self._handle, host, port)
+        return self.server
+
+    async def close(self):
+        for batcher in self.batchers.values():
+            batcher.close()
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+
+    async def _handle(self, reader, writer):
+        """Answer the requests of one connection (HTTP/1.1 with keep-alive)"""
+
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line.strip():
+                    break
+
+                method, path, _ = request_line.decode("latin-1").split(" ", 2)
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if not line.strip():
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+
+                length = int(headers.get("content-length", 0))
+                if length > MAX_BODY_BYTES:
+                    await self._respond(writer, 413, {"error": "request too large"})
+                    break
+                body = await reader.readexactly(length) if length else b""
+
+                status, answer = await self._dispatch(method, path, body)
+                await self._respond(writer, status, answer)
+
+                if headers.get("connection", "").lower() == "close":
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def _dispatch(self, method, path, body):
+        if path == "/health":
+            return 200, {"status": "ok",
+                         "models": [f"{model}:{lang}" for model, lang in self.models]}
+        if path != "/ner":
+            return 404, {"error": f"unknown path {path}"}
+        if method != "POST":
+            return 405, {"error": "use POST"}
+
+        try:
+            request = json.loads(body.decode("utf-8"))
+            if not isinstance(request, dict):
+                raise TypeError("the request must be a JSON object")
+            sentences = self._sentences(request)
+            model = (request.get("tool", "spacy"), request["lang"])
+        except (ValueError, KeyError, TypeError) as error:
+            return 400, {"error": f"invalid request: {error}"}
+
+        if model not in self.batchers:
+            return 400, {"error": f"model {model[0]}:{model[1]} is not loaded"}
+        batcher = self.batchers[model]
+
+        try:
+            preds = await batcher.predict(sentences)
+        except Exception as error:
+            return 500, {"error": str(error)}
+
+        words = [word for sentence in sentences for word in sentence]
+        labels = [label for sentence_labels in preds for label in sentence_labels]
+        return 200, {"words": words, "labels": labels}
+
+    @staticmethod
+    def _sentences(request):
+        """Return the sentences of a request: pretokenized words ("tokens")
+        are one sentence, a raw text ("text") is tokenized and split into
+        sentences
+
+        note: raises a TypeError resp. ValueError for invalid requests; the
+        tokens must be non-empty strings without whitespaces, since the
+        models split the words at whitespaces again
+        """
+
+        if "tokens" in request:
+            tokens = request["tokens"]
+            if not isinstance(tokens, list) or \
+                    not all(isinstance(token, str) for token in tokens):
+                raise TypeError("tokens must be a list of strings")
+            if not all(token.split() == [token] for token in tokens):
+                raise ValueError("tokens must be non-empty and must not contain whitespaces")
+            return [list(tokens)]
+
+        if not isinstance(request["text"], str):
+            raise TypeError("text must be a string")
+
+        words, _ = tokenize(request["text"])
+        return split_sentences(words)
+
+    @staticmethod
+    async def _respond(writer, status, answer):
+        body = json.dumps(answer, ensure_ascii=False).encode("utf-8")
+        head = (f"HTTP/1.1 {status} {REASONS[status]}\r\n"
+                f"Content-Type: application/json; charset=utf-8\r\n"
+                f"Content-Length: {len(body)}\r\n\r\n")
+        writer.write(head.encode("latin-1") + body)
+        await writer.drain()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Local NER service with SpaCy and Stanza")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--models", nargs="+", default=["spacy:en", "spacy:es"],
+                        help="models to load, as tool:language")
+    parser.add_argument("--max-batch-size", type=int, default=DEFAULT_BATCH_SIZE,
+                        help="maximum number of sentences of a micro-batch")
+    parser.add_argument("--max-wait-ms", type=float, default=DEFAULT_MAX_WAIT * 1000,
+                        help="maximum waiting time of a request for its micro-batch")
+    args = parser.parse_args(argv)
+
+    models = [tuple(pair.split(":", 1)) for pair in args.models]
+    for model, lang in models:
+        # raises a ValueError for unknown models before the server starts
+        get_model(model, lang)
+
+    async def serve():
+        server = NERServer(models, args.max_batch_size, args.max_wait_ms / 1000)
+        await server.start(args.host, args.port)
+        print(f"Serving NER on http://{args.host}:{args.port}/ner")
+        try:
+            await server.server.serve_forever()
+        finally:
+            await server.close()
+
+    asyncio.run(serve())
+
+
+if __name__ == "__main__":
+    main()
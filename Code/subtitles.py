@@ -0,0 +1,244 @@
+"""Reading of subtitle files in the SRT and WebVTT formats
+
+The files can be read directly, or out of zip and gzip archives without
+extracting them; the files are read as streams, line by line. Every word
+keeps the index and the timestamps of the cue it belongs to, so the NER
+labels can be mapped back to the cues (see labels_by_cue() and the corpus
+type "cues" of experiments.py).
+"""
+
+from collections import namedtuple
+import codecs
+import gzip
+import io
+import os
+import re
+import zipfile
+from utils import tokenize
+
+# one subtitle: number of the cue in the file (starting with 1), start and end
+# time in seconds, and the text lines
+Cue = namedtuple("Cue", ["index", "start", "end", "lines"])
+
+SUBTITLE_EXTENSIONS = (".srt", ".vtt")
+
+_BOMS = ((codecs.BOM_UTF8, "utf-8-sig"),
+         (codecs.BOM_UTF16_LE, "utf-16"),
+         (codecs.BOM_UTF16_BE, "utf-16"))
+
+# e.g. "00:01:02,500 --> 00:01:04,000" (SRT) or "01:02.500 --> 01:04.000 line:0"
+# (WebVTT, the hours are optional and the timestamps can be followed by
+# settings)
+_TIMESTAMPS = re.compile(r"((?:\d+:)?\d{1,2}:\d{2}[,.]\d{1,3})\s*-->\s*"
+                         r"((?:\d+:)?\d{1,2}:\d{2}[,.]\d{1,3})")
+
+# formatting tags such as <i>...</i>, <c.yellow> and {\an8}
+_TAGS = re.compile(r"<[^>]*>|\{[^}]*\}")
+
+
+def parse_timestamp(timestamp):
+    """Convert a timestamp such as "00:01:02,500" or "01:02.500" into seconds
+
+    args: timestamp (string)
+
+    return: seconds (float)
+    """
+
+    parts = timestamp.replace(",", ".").split(":")
+    seconds = 0.0
+
+    for part in parts:
+        seconds = seconds * 60 + float(part)
+
+    return seconds
+
+
+def format_timestamp(seconds):
+    """Convert seconds into a timestamp such as "00:01:02.500"
+
+    args: seconds (float)
+
+    return: timestamp (string)
+    """
+
+    milliseconds = round(seconds * 1000)
+    minutes, milliseconds = divmod(milliseconds, 60000)
+    hours, minutes = divmod(minutes, 60)
+
+    return f"{hours:02d}:{minutes:02d}:{milliseconds / 1000:06.3f}"
+
+
+def _decode_windows_1252(error):
+    """Error handler of the UTF-8 decoding of subtitle files: bytes which are
+    not UTF-8, e.g. in older files, are decoded as Windows-1252 resp. latin-1
+    """
+
+    text = []
+    for byte in error.object[error.start:error.end]:
+        try:
+            text.append(bytes([byte]).decode("cp1252"))
+        except UnicodeDecodeError:
+            # latin-1 can decode every byte
+            text.append(chr(byte))
+
+    return "".join(text), error.end
+
+
+codecs.register_error("subtitles", _decode_windows_1252)
+
+
+def _blocks(lines):
+    """Group lines into blocks separated by blank lines"""
+
+    block = []
+
+    for line in lines:
+        line = line.rstrip("\r\n")
+        if line.strip():
+            block.append(line)
+        elif block:
+            yield block
+            block = []
+
+    if block:
+        yield block
+
+
+def parse_cues(lines):
+    """Parse the cues of an SRT or WebVTT file
+
+    args: lines (iterable of the lines of the file, e.g. a file opened in
+    text mode, or the content of the file as one string)
+
+    return: generator of the cues (Cue), in the order of the file
+
+    note: the WebVTT header and NOTE, STYLE and REGION blocks don't contain a
+    timestamp line and are skipped
+    """
+
+    if isinstance(lines, str):
+        lines = lines.replace("\r\n", "\n").replace("\r", "\n").split("\n")
+
+    index = 0
+
+    for block in _blocks(lines):
+        # the timestamp line may be preceded by the number resp. identifier
+        # of the cue
+        for i, line in enumerate(block[:2]):
+            match = _TIMESTAMPS.search(line)
+            if match:
+                break
+        else:
+            continue
+
+        index += 1
+        cue_lines = [_TAGS.sub("", line).strip() for line in block[i + 1:]]
+        yield Cue(index, parse_timestamp(match.group(1)),
+                  parse_timestamp(match.group(2)),
+                  [line for line in cue_lines if line])
+
+
+def _open_text(infile):
+    """Open a subtitle file as a text stream with universal newlines, the
+    file is decoded while it is read, in a single pass
+
+    args: infile (the file opened in binary mode, with peek(), e.g. a file of
+    open(), gzip.open() or ZipFile.open())
+
+    note: the encoding is taken from the byte order mark if there is one,
+    otherwise the file is decoded as UTF-8 and the bytes which are not UTF-8
+    as Windows-1252 resp. latin-1 (see _decode_windows_1252())
+    """
+
+    head = infile.peek(4)[:4]
+
+    for bom, encoding in _BOMS:
+        if head.startswith(bom):
+            return io.TextIOWrapper(infile, encoding=encoding, newline=None)
+
+    return io.TextIOWrapper(infile, encoding="utf-8", errors="subtitles", newline=None)
+
+
+def iter_subtitle_sources(path):
+    """Yield the subtitle files of a path: a single .srt/.vtt file, a gzip
+    compressed file (e.g. .srt.gz), or all .srt/.vtt files of a zip archive;
+    the files are streamed out of the archives and never extracted to the
+    disk or read into memory as a whole
+
+    args: path (string, full path of the file or archive)
+
+    return: generator of (name, lines) tuples, name being the file name resp.
+    the name of the file in the archive, and lines the file opened in text
+    mode; it is closed when the next file is taken, so it has to be read
+    before
+    """
+
+    if zipfile.is_zipfile(path):
+        with zipfile.ZipFile(path) as archive:
+            for member in archive.infolist():
+                if member.filename.lower().endswith(SUBTITLE_EXTENSIONS):
+                    with _open_text(archive.open(member)) as infile:
+                        yield member.filename, infile
+    elif path.lower().endswith(".gz"):
+        with _open_text(gzip.open(path, "rb")) as infile:
+            yield os.path.basename(path)[:-3], infile
+    else:
+        with _open_text(open(path, "rb")) as infile:
+            yield os.path.basename(path), infile
+
+
+def cue_words(cues):
+    """Split the text of the cues into words, in the same way as
+    load_subtitles() in utils.py
+
+    args: cues (iterable of Cue)
+
+    return: words (list of all words), word_cues (list of the cue of each
+    word)
+    """
+
+    words = []
+    word_cues = []
+
+    for cue in cues:
+        for line in cue.lines:
+            line_words, _ = tokenize(line)
+            words.extend(line_words)
+            word_cues.extend([cue] * len(line_words))
+
+    return words, word_cues
+
+
+def load_subtitle_cues(path):
+    """Load a subtitle file in the SRT or WebVTT format, or all subtitle
+    files of an archive
+
+    args: path (string, full path of the file or archive)
+
+    return: generator of (name, words, word_cues) tuples, one per subtitle
+    file, see cue_words()
+    """
+
+    for name, lines in iter_subtitle_sources(path):
+        words, word_cues = cue_words(parse_cues(lines))
+        yield name, words, word_cues
+
+
+def labels_by_cue(words, word_cues, labels):
+    """Map the labels of the words back to the cues
+
+    args: words (list of all words), word_cues (list of the cue of each
+    word), labels (list of the label of each word)
+
+    return: list of (cue, [(word, label), ...]) tuples, in the order of the
+    cues
+    """
+
+    grouped = []
+
+    for word, cue, label in zip(words, word_cues, labels):
+        if not grouped or grouped[-1][0] is not cue:
+            grouped.append((cue, []))
+        grouped[-1][1].append((word, label))
+
+    return grouped
@@ -0,0 +1,97 @@
+"""Tests of the spaCy backends (backends.py)
+
+    python -m unittest test_backends
+
+The tests train a small pipeline with a shared tok2vec, a tagger and a NER,
+so no language model has to be installed.
+"""
+
+import tempfile
+import unittest
+from backends import SpacyBackend, SpacyNERBackend
+
+# sentences of the training data: words, entity labels (BILUO, as used by
+# spaCy for training)
+SENTENCES = [
+    (["Alice", "lives", "in", "Paris", "."], ["U-PERSON", "O", "O", "U-GPE", "O"]),
+    (["Bob", "works", "in", "Madrid", "."], ["U-PERSON", "O", "O", "U-GPE", "O"]),
+    (["Carol", "Smith", "visits", "Rome", "."], ["B-PERSON", "L-PERSON", "O", "U-GPE", "O"]),
+    (["Dave", "met", "Erin", "Smith", "in", "Berlin", "."],
+     ["U-PERSON", "O", "B-PERSON", "L-PERSON", "O", "U-GPE", "O"]),
+]
+
+# the sentences to compare
+INPUT = [
+    ["Alice", "lives", "in", "Rome", "."],
+    ["Erin", "Smith", "works", "in", "Berlin", "."],
+    ["Madrid", "."],
+]
+
+
+def _example(nlp, words, labels):
+    """Training example of one sentence with tags and entity labels"""
+
+    from spacy.tokens import Doc
+    from spacy.training import Example
+
+    tags = ["PUNCT" if word == "." else "X" for word in words]
+    return Example.from_dict(Doc(nlp.vocab, words=words),
+                             {"tags": tags, "entities": labels})
+
+
+def train_pipeline(path):
+    """Train a small English pipeline and save it in the given folder"""
+
+    from spacy.cli.init_config import init_config
+    from spacy.util import fix_random_seed, load_model_from_config
+
+    fix_random_seed(0)
+    config = init_config(lang="en", pipeline=["tagger", "ner"], optimize="efficiency")
+    nlp = load_model_from_config(config, auto_fill=True)
+
+    examples = [_example(nlp, words, labels) for words, labels in SENTENCES]
+    optimizer = nlp.initialize(lambda: examples)
+    for _ in range(30):
+        nlp.update(examples, sgd=optimizer)
+
+    nlp.to_disk(path)
+
+
+class SpacyBackendTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.folder = tempfile.TemporaryDirectory()
+        train_pipeline(cls.folder.name)
+
+        class Full(SpacyBackend):
+            MODELS = {"en": cls.folder.name}
+
+        class NER(SpacyNERBackend):
+            MODELS = {"en": cls.folder.name}
+
+        cls.full = Full("en")
+        cls.ner = NER("en")
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.folder.cleanup()
+
+    def test_ner_profile_excludes_components(self):
+        self.assertEqual(self.full.nlp.pipe_names, ["tok2vec", "tagger", "ner"])
+        self.assertEqual(self.ner.nlp.pipe_names, ["tok2vec", "ner"])
+
+    def test_same_labels(self):
+        labels = self.full.predict(INPUT)
+
+        self.assertEqual(labels[1][:2], ["B-PERSON", "I-PERSON"])
+        self.assertEqual(self.ner.predict(INPUT), labels)
+
+    def test_sentence_starts_from_input(self):
+        docs = list(self.ner.nlp.pipe(self.ner.sentence_docs(INPUT)))
+
+        self.assertEqual([len(list(doc.sents)) for doc in docs], [1, 1, 1])
+
+
+if __name__ == "__main__":
+    unittest.main()
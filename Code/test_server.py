@@ -0,0 +1,101 @@
+"""Tests of the local NER service (server.py) on localhost
+
+    python -m unittest test_server
+
+The tests use a small backend which labels capitalized words as persons, so
+no language model has to be installed.
+"""
+
+import asyncio
+import json
+import unittest
+from backends import NERBackend, register_backend, unload_models
+from server import NERServer
+
+
+class CapitalBackend(NERBackend):
+    """Labels every capitalized word as B-PER, and splits the joined words of
+    a sentence at whitespaces again like the spaCy backend
+    """
+
+    calls = []
+
+    @classmethod
+    def languages(cls):
+        return ["en"]
+
+    @classmethod
+    def model_name(cls, lang):
+        return "capital"
+
+    def predict(self, sentences):
+        self.calls.append(len(sentences))
+        return [["B-PER" if word[:1].isupper() else "O"
+                 for word in " ".join(sentence).split()]
+                for sentence in sentences]
+
+
+async def post(port, body):
+    """Send one POST /ner request and return the status and the answer"""
+
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    data = json.dumps(body).encode("utf-8")
+    writer.write(f"POST /ner HTTP/1.1\r\nContent-Length: {len(data)}\r\n"
+                 f"Connection: close\r\n\r\n".encode("latin-1") + data)
+    await writer.drain()
+
+    status = int((await reader.readline()).split()[1])
+    while (await reader.readline()).strip():
+        pass
+    answer = json.loads(await reader.read())
+    writer.close()
+
+    return status, answer
+
+
+class ServerTest(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        register_backend("capital", CapitalBackend)
+        CapitalBackend.calls.clear()
+        # a long waiting time, so that concurrent requests end up in the same
+        # micro-batch
+        self.server = NERServer([("capital", "en")], max_wait=0.2)
+        server = await self.server.start(port=0)
+        self.port = server.sockets[0].getsockname()[1]
+
+    async def asyncTearDown(self):
+        await self.server.close()
+        unload_models([("capital", "en")])
+
+    async def test_concurrent_requests(self):
+        first, second = await asyncio.gather(
+            post(self.port, {"lang": "en", "tool": "capital",
+                             "tokens": ["Alice", "met", "Bob"]}),
+            post(self.port, {"lang": "en", "tool": "capital",
+                             "text": "the trip to Madrid. Carol stayed home."}))
+
+        # both requests were processed in one micro-batch
+        self.assertEqual(CapitalBackend.calls, [3])
+
+        self.assertEqual(first, (200, {"words": ["Alice", "met", "Bob"],
+                                       "labels": ["B-PER", "O", "B-PER"]}))
+        status, answer = second
+        self.assertEqual(status, 200)
+        self.assertEqual(answer["words"], ["the", "trip", "to", "Madrid", ".",
+                                           "Carol", "stayed", "home", "."])
+        self.assertEqual(answer["labels"], ["O", "O", "O", "B-PER", "O",
+                                            "B-PER", "O", "O", "O"])
+
+    async def test_invalid_tokens(self):
+        for tokens in (["New York", "is", "big"], ["Alice", ""], "Abc", [1, 2]):
+            status, answer = await post(self.port, {"lang": "en", "tool": "capital",
+                                                    "tokens": tokens})
+            self.assertEqual(status, 400, tokens)
+            self.assertIn("error", answer)
+
+        self.assertEqual(CapitalBackend.calls, [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,7 +1,9 @@
-import spacy
-import stanza
 import re
-from spacy.tokens import Doc
+from itertools import islice
+from evaluation import compare_labels, build_differences, iter_differences, entity_scores
+from profiling import stage, traced, count
+from backends import (get_model, preload_models, unload_models, register_backend,
+                      get_backend_class)
 
 # SOURCE: https://stackoverflow.com/questions/65160277/spacy-tokenizer-with-only-whitespace-rule
 # by user "Sofie VL"
@@ -16,25 +18,32 @@ class WhitespaceTokenizer(object):
         self.vocab = vocab
 
     def __call__(self, text):
+        from spacy.tokens import Doc
+
         words = text.split()
         # All tokens 'own' a subsequent space character in this tokenizer
         spaces = [True] * len(words)
         return Doc(self.vocab, words=words, spaces=spaces)
-
-# loading the spaCy and Stanza language models for English and Spanish
-spacy_en = spacy.load("en_core_web_md")
-spacy_en.tokenizer = WhitespaceTokenizer(spacy_en.vocab)
-spacy_es = spacy.load("es_core_news_md")
-spacy_es.tokenizer = WhitespaceTokenizer(spacy_es.vocab)
 # END
 
-stanza_en = stanza.Pipeline("en", processors="tokenize,ner", 
-                            package={"ner": ["conll03"]},
-                            tokenize_pretokenized=True)
-stanza_es = stanza.Pipeline("es", processors="tokenize,ner", 
-                            package={"ner": ["conll02"]},
-                            tokenize_pretokenized=True)
+# default number of sentences which are processed together by the language
+# models in ner_sentences()
+DEFAULT_BATCH_SIZE = 64
+
+# default token budget of a batch: the sentences are sorted by length and
+# grouped into batches whose padded size (number of sentences times the length
+# of the longest sentence) stays below this number, see plan_batches()
+DEFAULT_MAX_TOKENS = 2048
+
+# number of sentences which are sorted by length together, the labels are
+# returned in the original order after each window
+BUCKET_WINDOW = 4096
+
+# the language models are wrapped in the backends of backends.py, and loaded
+# on first use with get_model()
 
+
+@traced("load")
 def load_europarl(filepath):
     """Load the data from a europarl conll02-file
 
@@ -68,6 +77,65 @@ def load_europarl(filepath):
     return words, labels, text
 
 
+def read_conll(filepath, label_column=-1, encoding="utf-8"):
+    """Read a CoNLL file (e.g. a europarl conll02-file) sentence by sentence,
+    without loading the whole file into memory
+
+    args: filepath (string, full path of the file), label_column (int, index
+    of the column with the gold labels, the last column by default), 
+    encoding (string, encoding of the file)
+
+    return: generator of (words, labels) tuples, one per sentence (lists of
+    the words resp. gold labels of the sentence)
+
+    note: the columns may be separated by tabs or spaces, the word is always
+    in the first column; "-DOCSTART-" lines and blank lines end a sentence
+    """
+
+    words = []
+    labels = []
+
+    with open(filepath, "r", encoding=encoding) as infile:
+        for line in infile:
+            line = line.rstrip("\r\n")
+            parts = line.split("\t") if "\t" in line else line.split()
+
+            if len(parts) > 1 and parts[0] != "-DOCSTART-":
+                words.append(parts[0])
+                labels.append(parts[label_column])
+            elif words:
+                # a blank line or the start of a new document ends the 
+                # current sentence
+                yield words, labels
+                words = []
+                labels = []
+
+    if words:
+        yield words, labels
+
+
+@traced("load")
+def load_europarl_sentences(filepath):
+    """Load the data from a europarl conll02-file and keep the sentence 
+    boundaries (blank lines) of the file
+
+    args: filepath (string, full path of the europarl file)
+
+    return: sentences (list of sentences, each a list of words), labels (list
+    of the gold labels of each sentence)
+    """
+
+    sentences = []
+    labels = []
+
+    for words, sentence_labels in read_conll(filepath):
+        sentences.append(words)
+        labels.append(sentence_labels)
+
+    return sentences, labels
+
+
+@traced("load")
 def load_subtitles(filepath):
     """Load movie subtitle txt-file, and remove blank lines and line breaks
 
@@ -80,25 +148,79 @@ def load_subtitles(filepath):
     computer, and can vary from computer to computer
     """
 
-    text = ""
+    words = list(iter_subtitle_words(filepath))
+    text = " ".join(words)
+
+    return words, text
+
+
+def iter_subtitle_words(filepath, encoding="latin-1"):
+    """Read a movie subtitle txt-file line by line and yield its words, 
+    without loading the whole file into memory
 
-    with open(filepath, "r", encoding="latin-1") as infile:
+    args: filepath (string, full path of the subtitle file), encoding 
+    (string, encoding of the file)
+
+    return: generator of all words in the file
+    """
+
+    with open(filepath, "r", encoding=encoding) as infile:
         for line in infile:
+            # blank lines and line breaks don't contain any words
+            yield from line.translate(_PUNCTUATION_TABLE).split()
+
+
+# add whitespaces before/after punctuation marks to facilitate tokenization,
+# and remove backslashes; the table is used with str.translate(), so the text
+# is processed in one single pass
+_PUNCTUATION_TABLE = str.maketrans({
+    **{mark: " " + mark for mark in ".,:!?)"},
+    **{mark: mark + " " for mark in "¿¡("},
+    "'": " ' ",
+    "\\": "",
+})
 
-            # if the line is not empty add it to the text
-            if line.strip():
-                text += line.strip("\n") + " "
 
-    # add whitespaces before/after punctuation marks to facilitate tokenization
-    text = re.sub(r'([.,:!?)])', r' \1', text)
-    text = re.sub(r'([¿¡(])', r'\1 ', text)
-    text = re.sub(r'\'', r' \' ', text)
-    text = re.sub(r'\\', r'', text)
+def tokenize(text):
+    """Split a raw text into words, in the same way as the subtitle files
 
+    args: text (string)
+
+    return: words (list of all words in the text), text (string with 
+    whitespaces around the punctuation marks)
+    """
+
+    text = text.translate(_PUNCTUATION_TABLE)
     words = text.split()
 
     return words, text
 
+
+def split_sentences(words, sentence_ends=(".", "!", "?")):
+    """Split a list of words, e.g. of a subtitle file, into sentences after
+    each sentence-final punctuation mark
+
+    args: words (list of all words), sentence_ends (punctuation marks which
+    end a sentence)
+
+    return: sentences (list of sentences, each a list of words)
+    """
+
+    sentences = []
+    sentence = []
+
+    for word in words:
+        sentence.append(word)
+        if word in sentence_ends:
+            sentences.append(sentence)
+            sentence = []
+
+    if sentence:
+        sentences.append(sentence)
+
+    return sentences
+
+
 def ner(text, model, lang):
     """Process the given text, and return the list of predicted labels
 
@@ -113,27 +235,260 @@ def ner(text, model, lang):
     case letters only
     """
 
-    if model == "spacy":
-        if lang == "en":
-            doc = spacy_en(text)
-            # ent_iob_: return the Named Entities in the BIO format, and the
-            # non-entities as well ("O")
-            # ent_type_: type of the entity according to the SpaCy tag set
-            preds = [doc[i].ent_iob_ + "-" + doc[i].ent_type_ for i in range(len(doc))]
-        elif lang == "es":
-            doc = spacy_es(text)
-            preds = [doc[i].ent_iob_ + "-" + doc[i].ent_type_ for i in range(len(doc))]
-    elif model == "stanza":
-        if lang == "en":
-            doc = stanza_en(text)
-            # token.ner: return the Named Entity tag of the current token
-            preds = [token.ner for sent in doc.sentences for token in sent.tokens]
-        elif lang == "es":
-            doc = stanza_es(text)
-            preds = [token.ner for sent in doc.sentences for token in sent.tokens]
+    backend = get_model(model, lang)
+
+    with stage("ner", model=model, lang=lang):
+        preds = backend.predict_text(text)
+
+    count("tokens", len(preds))
+
+    return preds
+
+
+def ner_sentences(sentences, model, lang, batch_size=DEFAULT_BATCH_SIZE,
+                  max_tokens=DEFAULT_MAX_TOKENS):
+    """Process the given sentences in batches, and return the list of 
+    predicted labels of all words in the order of the corpus
+
+    args: sentences (iterable of sentences, each a list of words), model 
+    (string, language model to be used i.e. spaCy or Stanza), lang (string, 
+    language of the text), batch_size (int, number of sentences processed 
+    together by the language model if max_tokens is None), max_tokens (int,
+    token budget of a batch of sentences of similar length, see 
+    plan_batches(); None for batches of batch_size sentences in the order of
+    the corpus)
+
+    return: list of all predicted labels (including recognized Named Entities
+    as well as words which are not Named Entities) in the BIO(ES) format
+
+    note: in contrast to ner(), the sentence boundaries are kept, so the 
+    language models never see the whole corpus as one single document
+    """
+
+    preds = []
+
+    for labels in iter_ner(sentences, model, lang, batch_size, max_tokens):
+        preds.extend(labels)
+
+    return preds
+
+
+def iter_ner(sentences, model, lang, batch_size=DEFAULT_BATCH_SIZE,
+             max_tokens=DEFAULT_MAX_TOKENS):
+    """Process the given sentences in batches, and yield the predicted labels
+    sentence by sentence, so that the sentences can be read from a stream
+
+    args: see ner_sentences()
+
+    return: generator of lists of the predicted labels, one per sentence, in
+    the order of the given sentences
+
+    note: with max_tokens, up to BUCKET_WINDOW sentences are read ahead and
+    sorted by length
+    """
+
+    backend = get_model(model, lang)
+
+    if max_tokens is None:
+        for batch in iter_batches(sentences, batch_size):
+            yield from ner_batch(backend, batch)
+        return
+
+    for window in iter_batches(sentences, BUCKET_WINDOW):
+        yield from ner_bucketed(backend, window, max_tokens)
+
+
+def ner_conll(filepath, model, lang, batch_size=DEFAULT_BATCH_SIZE,
+              max_tokens=DEFAULT_MAX_TOKENS, **kwargs):
+    """Read a CoNLL file sentence by sentence and perform the NER on it in 
+    batches, without holding the whole corpus in memory
+
+    args: filepath (string, full path of the file), model (string, language 
+    model to be used i.e. spaCy or Stanza), lang (string, language of the 
+    text), batch_size, max_tokens (int, see ner_sentences()), kwargs (further
+    arguments of read_conll())
+
+    return: generator of (words, gold_labels, pred_labels) tuples, one per
+    sentence
+    """
+
+    backend = get_model(model, lang)
+
+    for batch in iter_batches(read_conll(filepath, **kwargs),
+                              batch_size if max_tokens is None else BUCKET_WINDOW):
+        sentences = [words for words, _ in batch]
+        if max_tokens is None:
+            preds = ner_batch(backend, sentences)
+        else:
+            preds = ner_bucketed(backend, sentences, max_tokens)
+        for (words, gold_labels), pred_labels in zip(batch, preds):
+            yield words, gold_labels, pred_labels
+
+
+def ner_batch(backend, batch):
+    """Perform the NER on one batch of sentences
+
+    args: backend (NERBackend, see get_model()), batch (list of sentences, 
+    each a list of words)
+
+    return: list of the predicted labels of each sentence of the batch
+    """
+
+    # empty sentences do not have any labels and are not given to the models
+    indexes = [i for i, sentence in enumerate(batch) if sentence]
+    preds = [[] for _ in batch]
+
+    if not indexes:
+        return preds
+
+    sentences = [batch[i] for i in indexes]
+    n_tokens = sum(len(sentence) for sentence in sentences)
+
+    padded_tokens = len(sentences) * max(len(sentence) for sentence in sentences)
+
+    with stage("ner", sentences=len(sentences), tokens=n_tokens,
+               padded_tokens=padded_tokens):
+        sentence_preds = backend.predict(sentences)
+
+    count("batches")
+    count("sentences", len(sentences))
+    count("tokens", n_tokens)
+    count("padded_tokens", padded_tokens)
+
+    for i, labels in zip(indexes, sentence_preds):
+        preds[i] = labels
+
     return preds
 
 
+def plan_batches(lengths, max_tokens):
+    """Group sentences of similar length into batches under a token budget:
+    the sentences are sorted by length, and a batch is closed as soon as its
+    padded size (number of sentences times the length of the longest one)
+    would exceed max_tokens
+
+    args: lengths (list of the number of words of each sentence), max_tokens
+    (int, token budget of a batch)
+
+    return: list of batches, each a list of indexes into lengths
+
+    note: a sentence longer than max_tokens forms a batch of its own
+    """
+
+    # sorted() is stable, so sentences of the same length keep their order
+    order = sorted(range(len(lengths)), key=lengths.__getitem__)
+    batches = []
+    batch = []
+
+    for i in order:
+        # the sentences are sorted, so the current one is the longest
+        if batch and (len(batch) + 1) * lengths[i] > max_tokens:
+            batches.append(batch)
+            batch = []
+        batch.append(i)
+
+    if batch:
+        batches.append(batch)
+
+    return batches
+
+
+def batch_fill(batches):
+    """Fill efficiency of batches of sentences: the number of words divided
+    by the padded size of the batches, 1.0 if no padding is needed
+
+    args: batches (iterable of batches, each a list of sentences)
+
+    return: fill efficiency (float between 0 and 1)
+    """
+
+    n_tokens = 0
+    padded_tokens = 0
+
+    for batch in batches:
+        lengths = [len(sentence) for sentence in batch]
+        n_tokens += sum(lengths)
+        padded_tokens += len(lengths) * max(lengths, default=0)
+
+    return n_tokens / padded_tokens if padded_tokens else 1.0
+
+
+def ner_bucketed(backend, sentences, max_tokens=DEFAULT_MAX_TOKENS):
+    """Perform the NER on a list of sentences in batches of sentences of
+    similar length (see plan_batches()), so that short sentences are not
+    padded to the length of long ones
+
+    args: backend (NERBackend, see get_model()), sentences (list of
+    sentences, each a list of words), max_tokens (int, token budget of a
+    batch)
+
+    return: list of the predicted labels of each sentence, in the order of
+    the given sentences
+    """
+
+    preds = [None] * len(sentences)
+
+    for indexes in plan_batches([len(sentence) for sentence in sentences], max_tokens):
+        batch_preds = ner_batch(backend, [sentences[i] for i in indexes])
+        for i, labels in zip(indexes, batch_preds):
+            preds[i] = labels
+
+    return preds
+
+
+def iter_batches(items, batch_size):
+    """Split an iterable into lists of at most batch_size items"""
+
+    items = iter(items)
+    batch = list(islice(items, batch_size))
+    while batch:
+        yield batch
+        batch = list(islice(items, batch_size))
+
+
+# replacement_label as a dictonary.
+REPLACEMENT_LABEL = {"PERSON": "PER", "GPE": "LOC"}
+
+# updating the dictionary. The labels in the list are those that need to be 
+# replaced. Whilst the second argument is the label they're being replaced 
+# with.
+REPLACEMENT_LABEL.update(dict.fromkeys(['NORP', 'LANGUAGE', 'EVENT', 'LAW'], 
+                                       'MISC'))
+REPLACEMENT_LABEL.update(dict.fromkeys(['FAC', 'PRODUCT', 'WORK_OF_ART', 
+                                        'DATE', 'TIME', 'PERCENT', 'MONEY', 
+                                        'QUANTITY', 'ORDINAL', 'CARDINAL'], 
+                                        'O'))
+
+# '\b' is needed as it indicated the begining and end of a word, so that we
+# only replace labels that are exactly like the given argument and not 
+# words that contain the label. The patterns are compiled only once.
+_REPLACEMENT_PATTERNS = [(re.compile(r'\b{}\b'.format(old)), new)
+                         for old, new in REPLACEMENT_LABEL.items()]
+
+# table of all labels which were already transformed into the 4 label format,
+# fine-grained label -> label in the 4 label format
+_postprocessed_labels = {}
+
+
+def _postprocess_label(label):
+    """Transform one fine-grained label predicted by SpaCy into the 4 label
+    format, see postprocess_labels()"""
+
+    # replaces ALL instances of the old label with the new label
+    for pattern, new in _REPLACEMENT_PATTERNS:
+        label = pattern.sub(new, label)
+
+    # replaces the hanging '-' and hanging iob's from the labels.
+    # Checked if a hanging '-' or iob. O in the beginning means '-' at the 
+    # end means iob. Then replace them with O
+    # One could also put each iob + label varient in the dic. though that get's
+    # quite big; 'O' only appears if it's a non-entity. 
+    if label.startswith('O-') or label.endswith('-O'):
+        return 'O'
+    return label
+
+
+@traced("postprocess")
 def postprocess_labels(pred_labels):
     """Transform the fine-grained labels predicted by SpaCy into the 4 label
     format (PER, LOC, ORG, MISC), in which the europarl-data is annotated
@@ -147,34 +502,14 @@ def postprocess_labels(pred_labels):
     (ORG), LAW; O = O, FAC, PRODUCT, WORK_OF_ART, DATE, TIME, PERCENT, MONEY,
     QUANTITY, ORDINAL, CARDINAL"""
 
-    # replacement_label as a dictonary.
-    replacement_label = {"PERSON": "PER", "GPE": "LOC"}
-
-    # updating the dictionary. The labels in the list are those that need to be 
-    # replaced. Whilst the second argument is the label they're being replaced 
-    # with.
-    replacement_label.update(dict.fromkeys(['NORP', 'LANGUAGE', 'EVENT', 'LAW'], 
-                                           'MISC'))
-    replacement_label.update(dict.fromkeys(['FAC', 'PRODUCT', 'WORK_OF_ART', 
-                                            'DATE', 'TIME', 'PERCENT', 'MONEY', 
-                                            'QUANTITY', 'ORDINAL', 'CARDINAL'], 
-                                            'O'))
-    
-    # re.sub() from the "re" (regular expresion) modul. Replaces ALL instances 
-    # of the FIRST argument with the SECOND argument that are in the THIRD 
-    # argument
-    # '\b' is needed as it indicated the begining and end of a word, so that we
-    # only replace labels that are exactly like the given argument and not 
-    # words that contain the label. 
-    for old, new in replacement_label.items():
-        pred_labels = [re.sub(r'\b{}\b'.format(old), new, label) for label in pred_labels]
+    # SpaCy only uses a small tag set, so every different label is only 
+    # transformed once and all labels are then looked up in the table in a
+    # single pass
+    table = _postprocessed_labels
+    for label in set(pred_labels).difference(table):
+        table[label] = _postprocess_label(label)
 
-    # replaces the hanging '-' and hanging iob's from the labels.
-    # For loop through each label, checked if a hanging '-' or iob. O in the 
-    # beginning means '-' at the end means iob. Then replace them with O
-    # One could also put each iob + label varient in the dic. though that get's
-    # quite big; 'O' only appears if it's a non-entity. 
-    postprocessed = ['O' if label.startswith('O-') or label.endswith('-O') else label for label in pred_labels]
+    postprocessed = [table[label] for label in pred_labels]
 
     return postprocessed
 
@@ -196,7 +531,9 @@ def label_match(label1, label2):
         return False
 
 
-def eval_europarl(word_list, gold_labels, pred_labels, model):
+@traced("eval")
+def eval_europarl(word_list, gold_labels, pred_labels, model, with_differences=True,
+                  lazy=False):
     """Evaluate the europarl-file: compare predicted labels and the gold 
     labels, i.e. give the accuracy and return a list of all words which were
     annotated with a different label as their gold label
@@ -205,82 +542,90 @@ def eval_europarl(word_list, gold_labels, pred_labels, model):
     (list of all gold labels), pred_labels (list of all predicted labels 
     [including recognized Named Entities as well as words which are not Named 
     Entities] in the BIOES format), model (string, language model to be used 
-    i.e. spaCy or Stanza)
+    i.e. spaCy or Stanza), with_differences (bool, create the list 
+    differences, otherwise only the indexes of the differing words are 
+    returned), lazy (bool, return a generator of the differences instead of
+    a list, for the streamed reports of report.py)
 
     return: accuracy (float, accuracy of pred_labels with respect to the
-    gold_labels), differences (list of lists, consisting of word, gold label
-    and predicted label)
+    gold_labels), differences (list of lists, consisting of index, word, gold
+    label and predicted label; numpy array of the indexes if with_differences
+    is False)
 
     note: please write the names of the language models in lower case letters 
-    only
+    only; the labels of fine-grained models such as spaCy are transformed with
+    postprocess_labels() first; the comparison itself is done on integer arrays, see evaluation.py
     """
 
     if len(gold_labels) == len(pred_labels):
-        accuracy = 0.0
-        diff_indexes = []
-        differences = []
-        
-        if model == "spacy":
+        if get_backend_class(model).fine_grained:
             pred_labels = postprocess_labels(pred_labels)
 
-        for i in range(len(gold_labels)):
-            # if the current label matches with the corresponding gold label
-            # add 1 to the accuracy counter else add the current index to the
-            # list of indexes of words which differ from the gold labels
-            if label_match(gold_labels[i], pred_labels[i]):
-                accuracy += 1.0
-            else:
-                diff_indexes.append(i)
+        accuracy, diff_indexes = compare_labels(gold_labels, pred_labels)
 
-        # create the list differences
-        for index in diff_indexes:
-            diff = [index, word_list[index], gold_labels[index], pred_labels[index]]
-            differences.append(diff)
+        if not with_differences:
+            return accuracy, diff_indexes
 
-        # divide the accuracy counter by the length of the label list to get
-        # the accuracy in percent
-        accuracy = accuracy / len(gold_labels)
+        if lazy:
+            return accuracy, iter_differences(diff_indexes, word_list,
+                                              gold_labels, pred_labels)
+
+        differences = build_differences(diff_indexes, word_list, gold_labels,
+                                        pred_labels)
 
         return accuracy, differences
 
 
-def eval_subtitles(word_list, spacy_labels, stanza_labels):
+@traced("eval")
+def eval_europarl_entities(gold_labels, pred_labels, model):
+    """Evaluate the europarl-file on the level of the Named Entities: give the
+    precision, recall and F1 for each entity type and the confusion matrix of
+    the entity types
+
+    args: gold_labels (list of all gold labels), pred_labels (list of all 
+    predicted labels in the BIOES format), model (string, language model to 
+    be used i.e. spaCy or Stanza)
+
+    return: scores (dictionary, entity type resp. "micro" -> precision, 
+    recall, f1 and support), confusion (dictionary, gold type -> predicted 
+    type -> number of entities), see entity_scores() in evaluation.py
+    """
+
+    if len(gold_labels) == len(pred_labels):
+        if get_backend_class(model).fine_grained:
+            pred_labels = postprocess_labels(pred_labels)
+
+        return entity_scores(gold_labels, pred_labels)
+
+
+@traced("eval")
+def eval_subtitles(word_list, spacy_labels, stanza_labels, with_differences=True,
+                   lazy=False):
     """Evaluate the subtitle-file: measure the concordance between the labels
     predicted by the SpaCy and Stanza language models, and return a list of
     all words which were annotated differently with the two models
     
     args: word_list (list of all words in the subtitle-file), spacy_labels 
     (list of all labels predicted by SpaCy), stanza_labels (list of all labels 
-    predicted by Stanza)
+    predicted by Stanza), with_differences, lazy (bool, see eval_europarl())
     
     return: concordance (float, concordance of the lables predicted by the two
     language models), differences (list of lists, consisting of word and the 
     labels predicted by SpaCy and Stanza)"""
 
     if len(spacy_labels) == len(stanza_labels):
-        concordance = 0.0
-        diff_indexes = []
-        differences = []
-
         spacy_labels = postprocess_labels(spacy_labels)
 
-        for i in range(len(spacy_labels)):
-            # if the current SpaCy and Stanza labels match add 1 to the 
-            # concordance counter else add the current index to the
-            # list of indexes of words with different SpaCy and Stanza
-            # predictions
-            if label_match(spacy_labels[i], stanza_labels[i]):
-                concordance += 1.0
-            else:
-                diff_indexes.append(i)
-
-        # create the list differences
-        for index in diff_indexes:
-            diff = [index, word_list[index], spacy_labels[index], stanza_labels[index]]
-            differences.append(diff)
-
-        # divide the concordance counter by the length of the label list to get
-        # the concordance in percent
-        concordance = concordance / len(spacy_labels)
+        concordance, diff_indexes = compare_labels(spacy_labels, stanza_labels)
+
+        if not with_differences:
+            return concordance, diff_indexes
+
+        if lazy:
+            return concordance, iter_differences(diff_indexes, word_list,
+                                                 spacy_labels, stanza_labels)
+
+        differences = build_differences(diff_indexes, word_list, spacy_labels,
+                                        stanza_labels)
 
         return concordance, differences